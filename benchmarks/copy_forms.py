@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""copy_forms.py
+
+Micro-benchmark: precompiled serializers.CopyPlan copies versus the
+reflective all_fields() copy the _copy*ToForm helpers used to do.
+
+Run from the repository root with the App Engine SDK on PYTHONPATH:
+
+    python benchmarks/copy_forms.py [rows] [repeat]
+
+"""
+
+import os
+import sys
+import timeit
+from datetime import date
+from datetime import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from models import Session
+from models import SessionForm
+from serializers import CONFERENCE_PLAN
+from serializers import SESSION_PLAN
+
+
+def reflectiveConferenceCopy(conf):
+    """The pre-CopyPlan _copyConferenceToForm body."""
+    cf = ConferenceForm()
+    for field in cf.all_fields():
+        if hasattr(conf, field.name):
+            if field.name.endswith('Date'):
+                setattr(cf, field.name, str(getattr(conf, field.name)))
+            else:
+                setattr(cf, field.name, getattr(conf, field.name))
+        elif field.name == "websafeKey":
+            setattr(cf, field.name, conf.key.urlsafe())
+    cf.check_initialized()
+    return cf
+
+
+def reflectiveSessionCopy(session):
+    """The pre-CopyPlan _copySessionToForm body."""
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(session, field.name):
+            if field.name.endswith('date') or field.name.endswith('Time'):
+                setattr(sf, field.name, str(getattr(session, field.name)))
+            else:
+                setattr(sf, field.name, getattr(session, field.name))
+        elif field.name == "websafeKey":
+            setattr(sf, field.name, session.key.urlsafe())
+    sf.check_initialized()
+    return sf
+
+
+def makeRows(rows):
+    """Build in-memory Conference and Session entities (never put)."""
+    p_key = ndb.Key(Profile, 'bench@example.com')
+    confs = [Conference(key=ndb.Key(Conference, i + 1, parent=p_key),
+                        name='Conference %d' % i,
+                        description='Description %d' % i,
+                        organizerUserId='bench@example.com',
+                        topics=['Web', 'Cloud'], city='London',
+                        startDate=date(2015, 6, 1), month=6,
+                        endDate=date(2015, 6, 3),
+                        maxAttendees=100, seatsAvailable=50)
+             for i in range(rows)]
+    sessions = [Session(key=ndb.Key(Session, i + 1, parent=confs[0].key),
+                        name='Session %d' % i, highlights='Highlights',
+                        speaker='Speaker %d' % (i % 10), duration=60,
+                        organizerUserId='bench@example.com',
+                        typeOfSession=['Lecture'], date=date(2015, 6, 1),
+                        startTime=time(9, 0))
+                for i in range(rows)]
+    return confs, sessions
+
+
+def main(rows=1000, repeat=20):
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    try:
+        confs, sessions = makeRows(rows)
+        cases = [
+            ('conference reflective', reflectiveConferenceCopy, confs),
+            ('conference plan', CONFERENCE_PLAN.copy, confs),
+            ('session reflective', reflectiveSessionCopy, sessions),
+            ('session plan', SESSION_PLAN.copy, sessions),
+        ]
+        for label, copy, entities in cases:
+            best = min(timeit.repeat(lambda: [copy(e) for e in entities],
+                                     number=1, repeat=repeat))
+            print('%-24s %8.2f ms / %d rows' % (label, best * 1000, rows))
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""create_latency.py
+
+p50/p99 wall-clock latency of conference creation: the old write path
+(allocate_ids, then put, then the confirmation task, one after another)
+against _createConferenceObject, which takes its id from the instance's
+pool and overlaps the Conference put, the shard puts and the
+transactional email enqueue.
+
+Datastore, taskqueue and memcache RPCs are given simulated latency with
+rpc_latency.addLatency.
+
+Run from the repository root with the App Engine SDK on PYTHONPATH:
+
+    python benchmarks/create_latency.py [latency ms] [creations]
+
+"""
+
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+from rpc_latency import addLatency
+import seats
+
+USER = 'bench@example.com'
+
+
+def sequentialCreate(request):
+    """Conference creation before the id pool: three blocking RPCs."""
+    p_key = ndb.Key(Profile, USER)
+    c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
+    c_key = ndb.Key(Conference, c_id, parent=p_key)
+    conf = Conference(key=c_key, name=request.name, organizerUserId=USER,
+                      maxAttendees=request.maxAttendees,
+                      seatsAvailable=request.maxAttendees)
+    ndb.put_multi([conf] + seats.newShards(c_key, conf.seatsAvailable))
+    taskqueue.add(params={'email': USER, 'conferenceInfo': repr(request)},
+                  url='/tasks/send_confirmation_email')
+
+
+def percentiles(fn, creations):
+    """Return (p50, p99) wall-clock time of fn() in milliseconds."""
+    times = []
+    for i in range(creations):
+        ndb.get_context().clear_cache()
+        request = ConferenceForm(name='Conference %d' % i, maxAttendees=100)
+        start = time.time()
+        fn(request)
+        times.append((time.time() - start) * 1000)
+    times.sort()
+    return (times[len(times) // 2],
+            times[min(len(times) - 1, len(times) * 99 // 100)])
+
+
+def main(latency_ms=20, creations=200):
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=ROOT)
+    tb.init_search_stub()
+    tb.setup_env(ENDPOINTS_AUTH_EMAIL=USER,
+                 ENDPOINTS_AUTH_DOMAIN='example.com', overwrite=True)
+    try:
+        for service in ('datastore_v3', 'taskqueue', 'memcache'):
+            addLatency(service, latency_ms / 1000.0)
+        ndb.get_context().set_cache_policy(False)
+        ndb.get_context().set_memcache_policy(False)
+
+        api = ConferenceApi()
+        print('%-12s %10s %10s' % ('path', 'p50 ms', 'p99 ms'))
+        for name, fn in (('before', sequentialCreate),
+                         ('after', api._createConferenceObject)):
+            print('%-12s %10.1f %10.1f' % ((name,) +
+                                           percentiles(fn, creations)))
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+
+"""endpoint_suite.py
+
+Endpoint benchmark and load generator on the App Engine testbed stubs.
+
+Generates a synthetic dataset of about --scale entities (conferences
+with their sessions and speakers, profiles, and the search and facet
+indexes), then calls every ConferenceApi endpoint --iterations times
+and prints one JSON document: for each endpoint, successful calls per
+second, their p50/p95/p99 latency in milliseconds, the number of calls
+that raised, and RPCs per call by service, as counted by an apiproxy
+pre-call hook.  Save the output of a run per commit and compare them
+with jq or any JSON diff.  Endpoints with failed calls are reported on
+stderr, and the run exits non-zero if every call to an endpoint raised.
+
+Run from the repository root with the App Engine SDK on PYTHONPATH:
+
+    python benchmarks/endpoint_suite.py [--scale 10000] [--iterations 200]
+        [--latency-ms 0] [--only queryConferences,createSession]
+        [--output results.json]
+
+"""
+
+import argparse
+import collections
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import date
+from datetime import time as dtime
+from datetime import timedelta
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from protorpc import message_types
+
+from conference import CONF_ATTENDEES_GET_REQUEST
+from conference import CONF_GET_REQUEST
+from conference import CONF_LIST_GET_REQUEST
+from conference import CONF_POST_REQUEST
+from conference import SESS_GET_REQUEST
+from conference import SESS_POST_REQUEST
+from conference import SESS_SPEAKER_GET_REQUEST
+from conference import SESS_TIME_GET_REQUEST
+from conference import SESS_TYPE_GET_REQUEST
+from conference import SESSIONS_POST_REQUEST
+from conference import WISHLIST_GET_REQUEST
+from conference import WISHLIST_QUERY_GET_REQUEST
+from conference import WISHLIST_SPEAKER_GET_REQUEST
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceForm
+from models import ConferenceQueryForm
+from models import ConferenceQueryForms
+from models import ConferenceSearchForm
+from models import Profile
+from models import ProfileMiniForm
+from models import Session
+from models import SessionForm
+from models import SessionForms
+from models import SessionQueryForm
+from models import SessionQueryForms
+from models import Speaker
+from rpc_latency import addLatency
+import confsearch
+import facets
+
+USER = 'bench@example.com'
+CITIES = ('London', 'Paris', 'Berlin', 'Tokyo', 'Chicago', 'Sydney',
+          'Toronto', 'Madrid', 'Seoul', 'Lagos')
+TOPICS = ('Medical Innovations', 'Programming Languages', 'Web',
+          'Movie Making', 'Health and Nutrition', 'Cloud', 'Security')
+TYPES = ('Lecture', 'Workshop', 'Keynote', 'Panel')
+SESSIONS_PER_CONFERENCE = 10
+PROFILES_PER_CONFERENCE = 3
+SPEAKERS = 500
+BATCH = 500
+SEARCH_BATCH = 200      # most documents one search put takes
+SERVICES = ('datastore_v3', 'memcache', 'taskqueue', 'search', 'mail')
+
+
+class RpcCounter(object):
+    """RpcCounter -- counts RPCs by service; register its hook method
+    as an apiproxy pre-call hook (the hook lists inspect their hooks'
+    arguments, which a callable instance doesn't have)"""
+
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def hook(self, service, call, request, response):
+        self.counts[service] += 1
+
+
+def _asUser(email):
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+
+
+def _putBatched(entities):
+    for start in range(0, len(entities), BATCH):
+        ndb.put_multi(entities[start:start + BATCH])
+
+
+def populate(scale, rnd):
+    """Write about scale entities; return what the workload needs."""
+    per_conference = 1 + SESSIONS_PER_CONFERENCE + PROFILES_PER_CONFERENCE
+    num_confs = max(scale // per_conference, 10)
+
+    organisers = [ndb.Key(Profile, 'organizer%d@example.com' % i)
+                  for i in range(max(num_confs // 10, 1))]
+    profiles = [Profile(key=p_key, displayName=p_key.id(),
+                        mainEmail=p_key.id(), teeShirtSize='NOT_SPECIFIED')
+                for p_key in organisers]
+    profiles += [Profile(id='attendee%d@example.com' % i,
+                         displayName='Attendee %d' % i,
+                         mainEmail='attendee%d@example.com' % i,
+                         teeShirtSize='NOT_SPECIFIED')
+                 for i in range(num_confs * PROFILES_PER_CONFERENCE -
+                                len(organisers))]
+    profiles.append(Profile(id=USER, displayName='Bench', mainEmail=USER,
+                            teeShirtSize='NOT_SPECIFIED'))
+    _putBatched(profiles)
+
+    confs = []
+    for i in range(num_confs):
+        # the first conference is the benchmark user's own
+        p_key = ndb.Key(Profile, USER) if i == 0 else rnd.choice(organisers)
+        start = date(2016, 1, 1) + timedelta(days=rnd.randrange(365))
+        seats = rnd.choice((50, 100, 500, 1000))
+        confs.append(Conference(
+            parent=p_key, name='Conference %d' % i,
+            description='Synthetic conference number %d' % i,
+            organizerUserId=p_key.id(), city=rnd.choice(CITIES),
+            topics=rnd.sample(TOPICS, 2), startDate=start,
+            month=start.month, endDate=start + timedelta(days=2),
+            maxAttendees=seats, seatsAvailable=seats))
+    _putBatched(confs)
+
+    sessions = [Session(parent=conf.key, name='Session %d' % j,
+                        speaker='Speaker %d' % rnd.randrange(SPEAKERS),
+                        duration=rnd.choice((30, 45, 60, 90)),
+                        typeOfSession=[rnd.choice(TYPES)],
+                        organizerUserId=conf.organizerUserId,
+                        date=conf.startDate,
+                        startTime=dtime(rnd.randrange(8, 20)))
+                for conf in confs for j in range(SESSIONS_PER_CONFERENCE)]
+    _putBatched(sessions)
+
+    # the Speaker index _putSessions would have maintained
+    speakers = {}
+    for session in sessions:
+        c_key = session.key.parent()
+        speaker = speakers.setdefault(
+            (c_key, session.speaker),
+            Speaker(id=session.speaker, parent=c_key, name=session.speaker))
+        speaker.sessionKeys.append(session.key)
+        speaker.sessionNames.append(session.name)
+    _putBatched(list(speakers.values()))
+
+    for start in range(0, len(confs), SEARCH_BATCH):
+        confsearch.indexConferences(confs[start:start + SEARCH_BATCH])
+    facets.replace(facets.count(confs))
+
+    counts = {'Profile': len(profiles), 'Conference': len(confs),
+              'Session': len(sessions), 'Speaker': len(speakers)}
+    return confs, sessions, counts
+
+
+def workload(api, confs, sessions, rnd):
+    """Return [(endpoint name, call(i), setup(i) or None)] covering every
+    endpoint; setup runs before each call, untimed and uncounted."""
+    own = confs[0].key.urlsafe()
+    wscks = [conf.key.urlsafe() for conf in confs]
+    s_keys = [session.key.urlsafe() for session in sessions]
+
+    def conf_get(wsck):
+        return CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=wsck)
+
+    def conf_query(*filters):
+        return ConferenceQueryForms(filters=[
+            ConferenceQueryForm(field=f, operator=o, value=v)
+            for f, o, v in filters])
+
+    def as_bench(fn):
+        def call(i):
+            _asUser(USER)
+            return fn(i)
+        return call
+
+    def register(i):
+        # a fresh attendee each time, so no call is a conflict
+        _asUser('loadgen%d@example.com' % i)
+        return api.registerForConference(conf_get(rnd.choice(wscks)))
+
+    registered = {}
+
+    def register_leaver(i):
+        _asUser('leaver%d@example.com' % i)
+        registered[i] = rnd.choice(wscks)
+        api.registerForConference(conf_get(registered[i]))
+
+    def unregister(i):
+        _asUser('leaver%d@example.com' % i)
+        return api.unregisterFromConference(conf_get(registered.pop(i)))
+
+    def wishlist(i):
+        return WISHLIST_GET_REQUEST.combined_message_class(
+            sessionKey=rnd.choice(s_keys))
+
+    def session_form(name):
+        return dict(name=name,
+                    speaker='Speaker %d' % rnd.randrange(SPEAKERS),
+                    duration=60, typeOfSession=[rnd.choice(TYPES)],
+                    date='2016-06-01', startTime='10:00')
+
+    cases = [
+        ('getProfile', lambda i: api.getProfile(
+            message_types.VoidMessage())),
+        ('saveProfile', lambda i: api.saveProfile(
+            ProfileMiniForm(displayName='Bench %d' % i))),
+        ('createConference', lambda i: api.createConference(
+            ConferenceForm(name='Load conference %d' % i,
+                           city=rnd.choice(CITIES),
+                           topics=[rnd.choice(TOPICS)],
+                           startDate='2016-06-01', endDate='2016-06-03',
+                           maxAttendees=100))),
+        ('updateConference', lambda i: api.updateConference(
+            CONF_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=own,
+                description='Updated %d' % i))),
+        ('getConference', lambda i: api.getConference(
+            conf_get(rnd.choice(wscks)))),
+        ('getConferencesCreated', lambda i: api.getConferencesCreated(
+            CONF_LIST_GET_REQUEST.combined_message_class())),
+        ('queryConferences.city', lambda i: api.queryConferences(
+            conf_query(('CITY', 'EQ', rnd.choice(CITIES))))),
+        ('queryConferences.cityTopic', lambda i: api.queryConferences(
+            conf_query(('CITY', 'EQ', rnd.choice(CITIES)),
+                       ('TOPIC', 'EQ', rnd.choice(TOPICS))))),
+        ('queryConferences.maxAttendees', lambda i: api.queryConferences(
+            conf_query(('MAX_ATTENDEES', 'GT', str(rnd.choice((50, 500))))))),
+        ('searchConferences', lambda i: api.searchConferences(
+            ConferenceSearchForm(query=rnd.choice(CITIES)))),
+        ('getConferenceFacets', lambda i: api.getConferenceFacets(
+            message_types.VoidMessage())),
+        ('getConferenceSessions', lambda i: api.getConferenceSessions(
+            SESS_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=rnd.choice(wscks)))),
+        ('getConferenceSessionsByType',
+         lambda i: api.getConferenceSessionsByType(
+             SESS_TYPE_GET_REQUEST.combined_message_class(
+                 websafeConferenceKey=rnd.choice(wscks),
+                 typeOfSession=rnd.choice(TYPES)))),
+        ('getSessionsBySpeaker', lambda i: api.getSessionsBySpeaker(
+            SESS_SPEAKER_GET_REQUEST.combined_message_class(
+                speaker='Speaker %d' % rnd.randrange(SPEAKERS)))),
+        ('getSessionsByTime', lambda i: api.getSessionsByTime(
+            SESS_TIME_GET_REQUEST.combined_message_class(
+                startTime='%02d:00' % rnd.randrange(8, 20)))),
+        ('searchSessions', lambda i: api.searchSessions(SessionQueryForms(
+            filters=[SessionQueryForm(field='START_TIME', operator='LT',
+                                      value='19:00'),
+                     SessionQueryForm(field='TYPE', operator='NE',
+                                      value='Workshop')]))),
+        ('twoInequalitiesQuery', lambda i: api.twoInequalitiesQuery(
+            message_types.VoidMessage())),
+        ('filterPlayground', lambda i: api.filterPlayground(
+            message_types.VoidMessage())),
+        ('createSession', lambda i: api.createSession(
+            SESS_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=own,
+                **session_form('Load session %d' % i)))),
+        ('createSessions', lambda i: api.createSessions(
+            SESSIONS_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=own,
+                items=[SessionForm(**session_form('Load batch %d.%d' % (i, j)))
+                       for j in range(5)]))),
+        ('registerForConference', register),
+        ('unregisterFromConference', unregister),
+        ('addSessionsToWishlist', lambda i: api.addSessionsToWishlist(
+            wishlist(i))),
+        ('getSessionsInWishlist', lambda i: api.getSessionsInWishlist(
+            message_types.VoidMessage())),
+        ('getSessionsInWishlistBySpeaker',
+         lambda i: api.getSessionsInWishlistBySpeaker(
+             WISHLIST_SPEAKER_GET_REQUEST.combined_message_class(
+                 speaker='Speaker %d' % rnd.randrange(SPEAKERS)))),
+        ('queryWishlist', lambda i: api.queryWishlist(
+            WISHLIST_QUERY_GET_REQUEST.combined_message_class(
+                typeOfSession=rnd.choice(TYPES)))),
+        ('deleteSessionInWishlist', lambda i: api.deleteSessionInWishlist(
+            wishlist(i))),
+        ('getConferencesToAttend', lambda i: api.getConferencesToAttend(
+            message_types.VoidMessage())),
+        ('getConferenceAttendees', lambda i: api.getConferenceAttendees(
+            CONF_ATTENDEES_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=own))),
+        ('getAnnouncement', lambda i: api.getAnnouncement(
+            message_types.VoidMessage())),
+        ('getFeaturedSpeaker', lambda i: api.getFeaturedSpeaker(
+            conf_get(rnd.choice(wscks)))),
+    ]
+    setups = {'unregisterFromConference': register_leaver}
+    # everything but (un)registration runs as the benchmark user
+    return [(name, call if name in ('registerForConference',
+                                    'unregisterFromConference')
+             else as_bench(call), setups.get(name)) for name, call in cases]
+
+
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, len(ordered) * p // 100)]
+
+
+def measure(call, iterations, counter, setup=None):
+    """Run setup(i), if any, then call(i), iterations times; return the
+    call's statistics.  Latencies and throughput are of the successful
+    calls only; calls that raised are counted, with their first error,
+    in errors and error."""
+    times = []
+    errors = 0
+    error = None
+    elapsed = 0.0
+    rpcs = collections.Counter()
+    for i in range(iterations):
+        if setup:
+            try:
+                setup(i)
+            except Exception as e:
+                errors += 1
+                error = error or 'setup %s: %s' % (type(e).__name__, e)
+                continue
+        # each request gets a fresh in-context cache in production
+        ndb.get_context().clear_cache()
+        before = dict(counter.counts)
+        start = time.time()
+        try:
+            call(i)
+        except Exception as e:
+            errors += 1
+            error = error or '%s: %s' % (type(e).__name__, e)
+        else:
+            ms = (time.time() - start) * 1000
+            times.append(ms)
+            elapsed += ms / 1000
+        for service in SERVICES:
+            rpcs[service] += counter.counts[service] - before.get(service, 0)
+    times.sort()
+
+    def percentile(p):
+        return round(_percentile(times, p), 3) if times else None
+
+    return {
+        'calls': iterations,
+        'errors': errors,
+        'error': error,
+        'throughput_per_s': round(len(times) / elapsed, 2) if elapsed
+        else None,
+        'p50_ms': percentile(50),
+        'p95_ms': percentile(95),
+        'p99_ms': percentile(99),
+        'rpcs_per_call': dict(
+            (service, round(rpcs[service] / float(iterations), 2))
+            for service in SERVICES),
+    }
+
+
+def _commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT).strip().decode()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Endpoint benchmark and load generator')
+    parser.add_argument('--scale', type=int, default=10000,
+                        help='approximate number of entities to generate')
+    parser.add_argument('--iterations', type=int, default=200,
+                        help='calls per endpoint')
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='simulated latency of every RPC')
+    parser.add_argument('--only', default='',
+                        help='comma-separated endpoints to run')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='file to write (default stdout)')
+    args = parser.parse_args(argv)
+
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.
+        PseudoRandomHRConsistencyPolicy(probability=1))
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=ROOT)
+    tb.init_search_stub()
+    tb.init_mail_stub()
+    tb.init_app_identity_stub()
+    tb.setup_env(ENDPOINTS_AUTH_EMAIL=USER,
+                 ENDPOINTS_AUTH_DOMAIN='example.com', overwrite=True)
+    try:
+        rnd = random.Random(args.seed)
+        started = time.time()
+        confs, sessions, entities = populate(args.scale, rnd)
+        populate_s = time.time() - started
+
+        if args.latency_ms:
+            for service in ('datastore_v3', 'memcache', 'taskqueue'):
+                addLatency(service, args.latency_ms / 1000.0)
+        counter = RpcCounter()
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'endpoint_suite', counter.hook)
+
+        only = set(filter(None, args.only.split(',')))
+        results = collections.OrderedDict()
+        for name, call, setup in workload(ConferenceApi(), confs,
+                                          sessions, rnd):
+            if not only or name in only or name.split('.')[0] in only:
+                results[name] = measure(call, args.iterations, counter,
+                                        setup)
+    finally:
+        tb.deactivate()
+
+    report = collections.OrderedDict([
+        ('commit', _commit()),
+        ('timestamp', int(time.time())),
+        ('scale', args.scale),
+        ('entities', entities),
+        ('populate_s', round(populate_s, 2)),
+        ('iterations', args.iterations),
+        ('latency_ms', args.latency_ms),
+        ('endpoints', results),
+    ])
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    # a broken endpoint must not pass for a fast one
+    broken = []
+    for name, result in results.items():
+        if result['errors']:
+            sys.stderr.write('WARNING: %s: %d of %d calls raised; first: '
+                             '%s\n' % (name, result['errors'],
+                                       result['calls'], result['error']))
+        if result['errors'] == result['calls']:
+            broken.append(name)
+    if broken:
+        sys.exit('every call raised for: %s' % ', '.join(broken))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
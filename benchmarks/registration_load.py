@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+
+"""registration_load.py
+
+Load test: registrations/sec against one hot conference as the number of
+concurrent clients grows, with the seat counter sharded over
+seats.NUM_SHARDS entities versus a single shard (the old behaviour of
+every registration writing the same entity group).
+
+Run from the repository root with the App Engine SDK on PYTHONPATH:
+
+    python benchmarks/registration_load.py [registrations per client]
+
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from conference import ConferenceApi
+from models import Conference
+from models import Profile
+import seats
+
+CLIENTS = (1, 2, 4, 8, 16, 32)
+
+
+def _register(api, wsck, user_ids, errors):
+    """Register each user in turn, as one client would."""
+    for user_id in user_ids:
+        p_key = ndb.Key(Profile, user_id)
+        for shard_key in seats.reserveOrder(seats.getShards(
+                ndb.Key(urlsafe=wsck).get())):
+            try:
+                if api._registrationTransaction(p_key, wsck, shard_key,
+                                                True) is not None:
+                    break
+            except Exception:
+                errors.append(user_id)
+                break
+
+
+def run(clients, per_client, num_shards):
+    """Return registrations/sec for one (clients, shards) combination."""
+    seats.NUM_SHARDS = num_shards
+    p_key = ndb.Key(Profile, 'organizer')
+    c_key = ndb.Key(Conference, Conference.allocate_ids(size=1,
+                                                        parent=p_key)[0],
+                    parent=p_key)
+    capacity = clients * per_client
+    ndb.put_multi([Conference(key=c_key, name='Hot', organizerUserId='o',
+                              maxAttendees=capacity,
+                              seatsAvailable=capacity)] +
+                  seats.newShards(c_key, capacity))
+    users = ['user-%d-%d' % (clients, i) for i in range(capacity)]
+    ndb.put_multi([Profile(key=ndb.Key(Profile, u), displayName=u)
+                   for u in users])
+
+    api = ConferenceApi()
+    errors = []
+    threads = [threading.Thread(target=_register,
+                                args=(api, c_key.urlsafe(),
+                                      users[i::clients], errors))
+               for i in range(clients)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    return (capacity - len(errors)) / elapsed, len(errors)
+
+
+def main(per_client=50):
+    tb = testbed.Testbed()
+    tb.activate()
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+        probability=1)
+    tb.init_datastore_v3_stub(consistency_policy=policy)
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub()
+    try:
+        shard_counts = (1, seats.NUM_SHARDS)
+        print('%8s %16s %16s' % ('clients', 'regs/s 1 shard',
+                                 'regs/s %d shards' % shard_counts[1]))
+        for clients in CLIENTS:
+            rates = [run(clients, per_client, n) for n in shard_counts]
+            print('%8d %16.1f %16.1f' % (clients, rates[0][0], rates[1][0]))
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+"""rpc_latency.py
+
+Wall-clock latency of the tasklet read paths (getConference,
+getConferencesToAttend, addSessionsToWishlist) against their old
+one-RPC-after-another versions, with simulated datastore latency.
+
+The testbed stubs answer instantly, so every datastore RPC is given a
+fixed latency measured from the moment it is issued: RPCs that are in
+flight together overlap, RPCs issued one after another add up, just as
+they would against the real datastore.
+
+Run from the repository root with the App Engine SDK on PYTHONPATH:
+
+    python benchmarks/rpc_latency.py [latency ms] [repeat]
+
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from google.appengine.api import apiproxy_rpc
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from conference import CONF_GET_REQUEST
+from conference import ConferenceApi
+from conference import WISHLIST_GET_REQUEST
+from models import Conference
+from models import Profile
+from models import Session
+
+USER = 'bench@example.com'
+
+
+class LatencyRPC(apiproxy_rpc.RPC):
+    """RPC that completes no sooner than `latency` after it was made."""
+
+    latency = 0.0
+
+    def _MakeCallImpl(self):
+        self._ready_at = time.time() + self.latency
+        apiproxy_rpc.RPC._MakeCallImpl(self)
+
+    def _WaitImpl(self):
+        delay = self._ready_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        return apiproxy_rpc.RPC._WaitImpl(self)
+
+
+class LatencyStub(object):
+    """Wraps an API stub so its RPCs carry simulated latency."""
+
+    def __init__(self, stub, latency):
+        self._stub = stub
+        self._latency = latency
+
+    def __getattr__(self, name):
+        return getattr(self._stub, name)
+
+    def MakeSyncCall(self, *args, **kwargs):
+        time.sleep(self._latency)
+        return self._stub.MakeSyncCall(*args, **kwargs)
+
+    def CreateRPC(self):
+        rpc = LatencyRPC(stub=self._stub)
+        rpc.latency = self._latency
+        return rpc
+
+
+def addLatency(service, latency):
+    """Give every RPC to an already registered stub `latency` seconds."""
+    stub = apiproxy_stub_map.apiproxy.GetStub(service)
+    apiproxy_stub_map.apiproxy.ReplaceStub(service,
+                                           LatencyStub(stub, latency))
+
+
+def sequentialGetConference(wsck):
+    """getConference before tasklets: conference, then organiser."""
+    conf = ndb.Key(urlsafe=wsck).get()
+    conf.key.parent().get()
+
+
+def sequentialConferencesToAttend():
+    """getConferencesToAttend before tasklets: profile, conferences,
+       then organisers."""
+    prof = ndb.Key(Profile, USER).get()
+    confs = ndb.get_multi([ndb.Key(urlsafe=wsck)
+                           for wsck in prof.conferenceKeysToAttend])
+    ndb.get_multi(list(set(conf.key.parent() for conf in confs)))
+
+
+def sequentialAddToWishlist(s_key):
+    """_addToWishlist before tasklets: profile, session, put, get_multi."""
+    prof = ndb.Key(Profile, USER).get()
+    ndb.Key(urlsafe=s_key).get()
+    if s_key not in prof.sessionsInWishlist:
+        prof.sessionsInWishlist.append(s_key)
+    prof.put()
+    ndb.get_multi([ndb.Key(urlsafe=k) for k in prof.sessionsInWishlist])
+
+
+def setUp():
+    """Create organisers, conferences and sessions, and a profile
+       registered for every conference."""
+    confs = []
+    for i in range(5):
+        p_key = ndb.Key(Profile, 'organizer%d@example.com' % i)
+        Profile(key=p_key, displayName='Organizer %d' % i).put()
+        confs.append(Conference(parent=p_key, name='Conference %d' % i,
+                                organizerUserId=p_key.id()))
+    c_keys = ndb.put_multi(confs)
+    s_keys = ndb.put_multi([Session(parent=c_keys[0], name='Session %d' % i)
+                            for i in range(5)])
+    Profile(key=ndb.Key(Profile, USER), displayName='Bench',
+            mainEmail=USER, teeShirtSize='NOT_SPECIFIED',
+            conferenceKeysToAttend=[k.urlsafe() for k in c_keys]).put()
+    return c_keys[0].urlsafe(), s_keys[0].urlsafe()
+
+
+def timeit(fn, repeat):
+    """Return the median wall-clock time of fn() in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        ndb.get_context().clear_cache()
+        start = time.time()
+        fn()
+        times.append((time.time() - start) * 1000)
+    return sorted(times)[len(times) // 2]
+
+
+def main(latency_ms=20, repeat=20):
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub()
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub()
+    tb.setup_env(ENDPOINTS_AUTH_EMAIL=USER,
+                 ENDPOINTS_AUTH_DOMAIN='example.com', overwrite=True)
+    try:
+        wsck, s_key = setUp()
+        addLatency('datastore_v3', latency_ms / 1000.0)
+        ndb.get_context().set_cache_policy(False)
+        ndb.get_context().set_memcache_policy(False)
+
+        api = ConferenceApi()
+        conf_req = CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=wsck)
+        wish_req = WISHLIST_GET_REQUEST.combined_message_class(
+            sessionKey=s_key)
+        cases = [
+            ('getConference',
+             lambda: sequentialGetConference(wsck),
+             lambda: api.getConference(conf_req)),
+            ('getConferencesToAttend',
+             sequentialConferencesToAttend,
+             lambda: api._getConferencesToAttendAsync().get_result()),
+            ('addSessionsToWishlist',
+             lambda: sequentialAddToWishlist(s_key),
+             lambda: api._addToWishlistAsync(wish_req, False).get_result()),
+        ]
+        print('%-24s %12s %12s' % ('endpoint', 'before ms', 'after ms'))
+        for name, before, after in cases:
+            print('%-24s %12.1f %12.1f' % (name, timeit(before, repeat),
+                                           timeit(after, repeat)))
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
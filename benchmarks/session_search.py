@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""session_search.py
+
+Benchmark the searchSessions planner over a synthetic session dataset
+against the twoInequalitiesQuery approach of querying on one inequality
+and filtering everything else in Python.
+
+Run from the repository root with the App Engine SDK on PYTHONPATH:
+
+    python benchmarks/session_search.py [sessions] [repeat]
+
+"""
+
+import os
+import random
+import sys
+import time
+from datetime import date
+from datetime import time as dtime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from models import Conference
+from models import Profile
+from models import Session
+from models import SessionQueryForm
+import sessionquery
+
+TYPES = ('Lecture', 'Workshop', 'Keynote', 'Panel', 'Social')
+
+# (label, filters as (field, operator, value))
+SEARCHES = [
+    ('non-workshops before 19:00',
+     [('START_TIME', 'LT', '19:00'), ('TYPE', 'NE', 'Workshop')]),
+    ('speaker, short, morning',
+     [('SPEAKER', 'EQ', 'Speaker 7'), ('DURATION', 'LTEQ', '45'),
+      ('START_TIME', 'LT', '12:00')]),
+    ('day, lectures, long',
+     [('DATE', 'EQ', '2015-06-02'), ('TYPE', 'EQ', 'Lecture'),
+      ('DURATION', 'GTEQ', '90')]),
+]
+
+
+def populate(count, batch=1000):
+    """Write count sessions spread over a handful of conferences."""
+    rnd = random.Random(42)
+    p_key = ndb.Key(Profile, 'bench@example.com')
+    c_keys = ndb.put_multi([Conference(parent=p_key, name='Conf %d' % i)
+                            for i in range(10)])
+    for start in range(0, count, batch):
+        ndb.put_multi([Session(parent=rnd.choice(c_keys),
+                               name='Session %d' % i,
+                               speaker='Speaker %d' % rnd.randrange(500),
+                               duration=rnd.choice((30, 45, 60, 90, 120)),
+                               typeOfSession=[rnd.choice(TYPES)],
+                               date=date(2015, 6, rnd.randrange(1, 6)),
+                               startTime=dtime(rnd.randrange(8, 22), 0))
+                       for i in range(start, min(start + batch, count))])
+
+
+def planned(filters):
+    """Stream the planned query, keep residual matches."""
+    pushed, residual = sessionquery.plan(filters)
+    return [s for s in sessionquery.buildQuery(pushed)
+            if sessionquery.matches(s, residual)]
+
+
+def naive(filters):
+    """Push the first inequality only (as twoInequalitiesQuery does)."""
+    first = [f for f in filters if f['operator'] not in ('=', '!=')][:1]
+    return [s for s in sessionquery.buildQuery(first)
+            if sessionquery.matches(s, filters)]
+
+
+def main(count=100000, repeat=3):
+    tb = testbed.Testbed()
+    tb.activate()
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+        probability=1)
+    tb.init_datastore_v3_stub(consistency_policy=policy)
+    tb.init_memcache_stub()
+    try:
+        populate(count)
+        ndb.get_context().set_cache_policy(False)
+        print('%-30s %8s %12s %12s' % ('search', 'matches', 'planned ms',
+                                       'naive ms'))
+        for label, raw in SEARCHES:
+            filters = sessionquery.formatFilters(
+                [SessionQueryForm(field=f, operator=o, value=v)
+                 for f, o, v in raw])
+            timings = []
+            for fn in (planned, naive):
+                best = None
+                for _ in range(repeat):
+                    start = time.time()
+                    found = fn(filters)
+                    elapsed = (time.time() - start) * 1000
+                    best = elapsed if best is None else min(best, elapsed)
+                timings.append(best)
+            print('%-30s %8d %12.1f %12.1f' % (label, len(found),
+                                               timings[0], timings[1]))
+    finally:
+        tb.deactivate()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+
+"""cache.py
+
+Udacity conference server-side Python App Engine read-through caches
+
+Conference entities are read through two tiers: a small in-instance LRU
+(entries live LOCAL_TTL seconds, so other instances' writes show up
+quickly) and memcache (entries stamped with a per-conference version).
+Every Conference write bumps the version and drops both tiers once the
+write commits, so a reader that raced the write can never re-populate
+memcache with the old entity under the current version.
+
+queryConferences results are cached in memcache under their canonical
+filter set, stamped with a global generation that every Conference
+write bumps; the entry and the generation come back in one round trip.
+Non-ancestor queries are eventually consistent, so for
+QUERY_SETTLE_SECONDS after a bump results aren't cached at all: a query
+run then may not see the write yet, and caching it under the new
+generation would hide the write until the entry expires.
+
+snapshot() returns this instance's hit and miss counts and rates;
+main.py serves them with the RPC statistics at /admin/rpcstats.
+
+"""
+
+import collections
+import hashlib
+import threading
+import time
+
+from google.appengine.api import memcache
+from google.appengine.datastore import entity_pb
+from google.appengine.ext import ndb
+
+LOCAL_CACHE_SIZE = 500
+LOCAL_TTL = 2           # seconds
+MEMCACHE_TTL = 600      # seconds
+MEMCACHE_CONF_KEY = "CONF_%s"
+MEMCACHE_CONF_VERSION_KEY = "CONF_VERSION_%s"
+MEMCACHE_QUERY_KEY = "CONF_QUERY_%s"
+MEMCACHE_QUERY_GENERATION_KEY = "CONF_QUERY_GENERATION"
+MEMCACHE_QUERY_SETTLING_KEY = "CONF_QUERY_SETTLING"
+QUERY_TTL = 300         # seconds
+QUERY_SETTLE_SECONDS = 5
+
+# per-instance hit/miss counters
+stats = collections.Counter()
+
+
+class LRUCache(object):
+    """LRUCache -- thread-safe in-process LRU with per-entry expiry"""
+
+    def __init__(self, size):
+        self._size = size
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the live value for key, or None."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[1] <= time.time():
+                return None
+            self._entries[key] = entry      # most recently used
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        """Store value for ttl seconds, evicting the least recently used."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, time.time() + ttl)
+            while len(self._entries) > self._size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+_conferences = LRUCache(LOCAL_CACHE_SIZE)
+# converts between entities and protocol buffers, as ndb's own
+# memcache integration does
+_adapter = ndb.ModelAdapter()
+
+
+def _encode(conf):
+    return _adapter.entity_to_pb(conf).Encode()
+
+
+def _decode(data):
+    # a fresh entity per read, so callers can't mutate a shared copy
+    return _adapter.pb_to_entity(entity_pb.EntityProto(data))
+
+
+def getConference(c_key):
+    """Return the Conference for c_key (or None) via the cache."""
+    return getConferenceAsync(c_key).get_result()
+
+
+@ndb.tasklet
+def getConferenceAsync(c_key):
+    """Tasklet version of getConference()."""
+    wsck = c_key.urlsafe()
+    data = _conferences.get(wsck)
+    if data is not None:
+        stats['local_hits'] += 1
+        raise ndb.Return(_decode(data))
+
+    # entry and version come back in one batched memcache get
+    ctx = ndb.get_context()
+    entry, version = yield (ctx.memcache_get(MEMCACHE_CONF_KEY % wsck),
+                            ctx.memcache_get(MEMCACHE_CONF_VERSION_KEY % wsck))
+    if entry and entry[0] == version:
+        stats['memcache_hits'] += 1
+        _conferences.set(wsck, entry[1], LOCAL_TTL)
+        raise ndb.Return(_decode(entry[1]))
+
+    stats['misses'] += 1
+    if version is None:
+        # seed a version that no older entry can carry; if another
+        # reader beats us to it, just skip populating this time
+        version = int(time.time() * 1000)
+        added = yield ctx.memcache_add(MEMCACHE_CONF_VERSION_KEY % wsck,
+                                       version)
+        if not added:
+            version = None
+
+    conf = yield c_key.get_async()
+    if conf and version is not None:
+        data = _encode(conf)
+        yield ctx.memcache_set(MEMCACHE_CONF_KEY % wsck, (version, data),
+                               time=MEMCACHE_TTL)
+        _conferences.set(wsck, data, LOCAL_TTL)
+    raise ndb.Return(conf)
+
+
+def invalidateConference(c_key):
+    """Drop a Conference from both tiers, and all cached query results,
+       once the current write (or transaction) commits."""
+    wsck = c_key.urlsafe()
+
+    def invalidate():
+        _conferences.delete(wsck)
+        memcache.incr(MEMCACHE_CONF_VERSION_KEY % wsck,
+                      initial_value=int(time.time() * 1000))
+        memcache.delete(MEMCACHE_CONF_KEY % wsck)
+        stats['invalidations'] += 1
+
+    ndb.get_context().call_on_commit(invalidate)
+    invalidateQueries()
+
+
+def queryId(filters, *extra):
+    """Return a canonical id for a formatted filter set (plus any paging
+       arguments): filters are typed already, so only order is left."""
+    canonical = sorted((f['field'], f['operator'], f['value'])
+                       for f in filters)
+    return hashlib.sha1(repr((canonical, extra))).hexdigest()
+
+
+def getQueryResult(query_id):
+    """Return (cached result or None, generation to store a result with,
+       or None if it shouldn't be stored)."""
+    key = MEMCACHE_QUERY_KEY % query_id
+    entries = memcache.get_multi([key, MEMCACHE_QUERY_GENERATION_KEY,
+                                  MEMCACHE_QUERY_SETTLING_KEY])
+    generation = entries.get(MEMCACHE_QUERY_GENERATION_KEY)
+    entry = entries.get(key)
+    if entry and entry[0] == generation:
+        stats['query_hits'] += 1
+        return entry[1], generation
+
+    stats['query_misses'] += 1
+    if entries.get(MEMCACHE_QUERY_SETTLING_KEY):
+        # a write just bumped the generation; the query may miss it
+        stats['query_settling'] += 1
+        return None, None
+    if generation is None:
+        # same seeding as the conference versions above
+        generation = int(time.time() * 1000)
+        if not memcache.add(MEMCACHE_QUERY_GENERATION_KEY, generation):
+            generation = None
+    return None, generation
+
+
+def setQueryResult(query_id, generation, data):
+    """Cache a query result computed under generation."""
+    if generation is not None:
+        memcache.set(MEMCACHE_QUERY_KEY % query_id, (generation, data),
+                     time=QUERY_TTL)
+
+
+def invalidateQueries():
+    """Retire every cached query result once the current write commits,
+       and stop caching new ones for QUERY_SETTLE_SECONDS."""
+    def invalidate():
+        memcache.set(MEMCACHE_QUERY_SETTLING_KEY, 1,
+                     time=QUERY_SETTLE_SECONDS)
+        memcache.incr(MEMCACHE_QUERY_GENERATION_KEY,
+                      initial_value=int(time.time() * 1000))
+
+    ndb.get_context().call_on_commit(invalidate)
+
+
+def _rate(hits, misses):
+    total = hits + misses
+    return round(float(hits) / total, 3) if total else None
+
+
+def snapshot():
+    """Return this instance's cache counters and hit rates."""
+    counts = dict(stats)
+    conf_hits = counts.get('local_hits', 0) + counts.get('memcache_hits', 0)
+    return {'counts': counts,
+            'conference_hit_rate': _rate(conf_hits, counts.get('misses', 0)),
+            'query_hit_rate': _rate(counts.get('query_hits', 0),
+                                    counts.get('query_misses', 0))}
+
+
+def reset():
+    """Drop this instance's cache counters."""
+    stats.clear()
@@ -14,13 +14,18 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 
 from datetime import datetime
+import logging
+import time
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protobuf
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
+from google.appengine.api import search
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
 
@@ -30,15 +35,32 @@ from models import ProfileMiniForm
 from models import ProfileForm
 from models import StringMessage
 from models import BooleanMessage
+from models import WishlistDeltaForm
+from models import WishlistEntry
+from models import Registration
+from models import AttendeeForm
+from models import AttendeeForms
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
+from models import ConferenceSearchForm
+from models import ConferenceFacetsForm
+from models import FacetValueForm
 from models import TeeShirtSize
 from models import Session
 from models import SessionForm
 from models import SessionForms
+from models import SessionQueryForms
+from models import ListView
+from models import Speaker
+
+from serializers import CONFERENCE_PLAN
+from serializers import CONFERENCE_SUMMARY_PLAN
+from serializers import PROFILE_PLAN
+from serializers import SESSION_PLAN
+from serializers import SESSION_SUMMARY_PLAN
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
@@ -47,13 +69,56 @@ from settings import ANDROID_AUDIENCE
 
 from utils import getUserId
 
+from queryfilters import OPERATORS
+
+from soldout import MEMCACHE_ANNOUNCEMENTS_KEY
+
+import cache
+import confquery
+import confsearch
+import facets
+import idpool
+import mailer
+import profiler
+import rpcstats
+import seats
+import sessionquery
+import soldout
+
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
-MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
+MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER_%s"
 ANNOUNCEMENT_FEATURED_SPEAKER = ('Featured Speaker: %s; Sessions: %s')
-ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
-                    'are nearly sold out: %s')
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+# a batch commits its sessions plus up to one Speaker row per session,
+# which must stay within 500 entities per commit
+MAX_SESSIONS_PER_BATCH = 250
+MAX_SCAN_PER_PAGE = 1000
+BACKFILL_BATCH_SIZE = 100
+SCAN_BATCH_SIZE = 200
+
+# what browse lists show; view=SUMMARY projects only these
+CONFERENCE_SUMMARY_FIELDS = ('name', 'city', 'startDate', 'endDate',
+                             'seatsAvailable')
+SESSION_SUMMARY_FIELDS = ('name', 'speaker', 'date', 'startTime')
+# the composite indexes the fixed-shape view=SUMMARY projections need,
+# as (kind, ancestor, properties: equality filters, then the projected
+# fields); tools/gen_indexes.py writes them to index.yaml
+SUMMARY_INDEXES = (
+    # getConferencesCreated
+    ('Conference', True, tuple(sorted(CONFERENCE_SUMMARY_FIELDS))),
+    # getConferenceSessions
+    ('Session', True, tuple(sorted(SESSION_SUMMARY_FIELDS))),
+    # getConferenceSessionsByType
+    ('Session', True,
+     ('typeOfSession',) + tuple(sorted(SESSION_SUMMARY_FIELDS))),
+    # getSessionsByTime; startTime is pinned, so not projected
+    ('Session', False,
+     ('startTime',) + tuple(sorted(set(SESSION_SUMMARY_FIELDS) -
+                                   set(['startTime'])))),
+)
+FEATURED_SPEAKER_DELAY = 5  # seconds sessions are coalesced for
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -69,13 +134,6 @@ SESSION_DEFAULTS = {
     "typeOfSession": ["Default"],
 }
 
-OPERATORS = {'EQ':   '=',
-             'GT':   '>',
-             'GTEQ': '>=',
-             'LT':   '<',
-             'LTEQ': '<=',
-             'NE':   '!='}
-
 FIELDS = {'CITY': 'city',
           'TOPIC': 'topics',
           'MONTH': 'month',
@@ -86,6 +144,20 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_ATTENDEES_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
+CONF_LIST_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1),
+    pageToken=messages.StringField(2),
+    view=messages.EnumField(ListView, 3, default='FULL'),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -94,22 +166,34 @@ CONF_POST_REQUEST = endpoints.ResourceContainer(
 SESS_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+    view=messages.EnumField(ListView, 4, default='FULL'),
 )
 
 SESS_TYPE_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     typeOfSession=messages.StringField(1),
     websafeConferenceKey=messages.StringField(2),
+    pageSize=messages.IntegerField(3),
+    pageToken=messages.StringField(4),
+    view=messages.EnumField(ListView, 5, default='FULL'),
 )
 
 SESS_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     speaker=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+    view=messages.EnumField(ListView, 4, default='FULL'),
 )
 
 SESS_TIME_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     startTime=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+    view=messages.EnumField(ListView, 4, default='FULL'),
 )
 
 SESS_POST_REQUEST = endpoints.ResourceContainer(
@@ -117,6 +201,11 @@ SESS_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+SESSIONS_POST_REQUEST = endpoints.ResourceContainer(
+    SessionForms,
+    websafeConferenceKey=messages.StringField(1),
+)
+
 WISHLIST_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     sessionKey=messages.StringField(1),
@@ -127,6 +216,13 @@ WISHLIST_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
     speaker=messages.StringField(1),
 )
 
+WISHLIST_QUERY_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    speaker=messages.StringField(1),
+    date=messages.StringField(2),
+    typeOfSession=messages.StringField(3),
+)
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 
@@ -136,23 +232,147 @@ WISHLIST_SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
+# - - - Paging - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _pageSize(self, request):
+        """Return the request's checked pageSize."""
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if not 0 < page_size <= MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                "pageSize must be between 1 and %d." % MAX_PAGE_SIZE)
+        return page_size
+
+    def _pageCursor(self, request):
+        """Return the request's pageToken as a datastore cursor."""
+        if not request.pageToken:
+            return None
+        try:
+            return ndb.Cursor(urlsafe=request.pageToken)
+        except datastore_errors.BadValueError:
+            raise endpoints.BadRequestException("Invalid pageToken.")
+
+    def _fetchPage(self, query, request, projection=None):
+        """Fetch one page of query results using a datastore cursor;
+           return (entities, nextPageToken)."""
+        page_size = self._pageSize(request)
+        cursor = self._pageCursor(request)
+        entities, next_cursor, more = query.fetch_page(page_size,
+                                                       start_cursor=cursor,
+                                                       projection=projection)
+        # only hand out a token when there is something left to fetch
+        next_token = next_cursor.urlsafe() if more and next_cursor else None
+        return entities, next_token
+
+    def _fetchListPage(self, items, request):
+        """Return one page of an in-memory list; the token is an offset."""
+        page_size = self._pageSize(request)
+        try:
+            start = int(request.pageToken or 0)
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid pageToken.")
+        # a negative offset would slice from the end of the list
+        if start < 0:
+            raise endpoints.BadRequestException("Invalid pageToken.")
+
+        end = start + page_size
+        next_token = str(end) if end < len(items) else None
+        return items[start:end], next_token
+
+    def _fetchNestedPage(self, query, request, items):
+        """Return one page of the lists items(entity) holds for each
+           entity query returns, in query order.  The token is the
+           cursor before the entity the page stopped in and how many of
+           its items were already returned, so a page reads only the
+           entities it covers."""
+        page_size = self._pageSize(request)
+        cursor, _, skip = (request.pageToken or ':0').rpartition(':')
+        try:
+            cursor = ndb.Cursor(urlsafe=cursor) if cursor else None
+            skip = int(skip)
+        except (datastore_errors.BadValueError, ValueError):
+            raise endpoints.BadRequestException("Invalid pageToken.")
+        if skip < 0:
+            raise endpoints.BadRequestException("Invalid pageToken.")
+
+        results = query.iter(start_cursor=cursor, produce_cursors=True,
+                             batch_size=page_size)
+        page = []
+        for entity in results:
+            entity_items = items(entity)
+            room = page_size - len(page)
+            if len(entity_items) - skip > room:
+                page.extend(entity_items[skip:skip + room])
+                return page, '%s:%d' % (results.cursor_before().urlsafe(),
+                                        skip + room)
+            page.extend(entity_items[skip:])
+            skip = 0
+            if len(page) == page_size:
+                if results.has_next():
+                    return page, '%s:0' % results.cursor_after().urlsafe()
+                break
+        return page, None
+
+    def _fetchFilteredPage(self, query, request, accept):
+        """Like _fetchPage, but stream the query and keep only entities
+           for which accept() is true.  A page ends after pageSize
+           matches or MAX_SCAN_PER_PAGE scanned entities, whichever
+           comes first, so a selective residual can't run unbounded."""
+        page_size = self._pageSize(request)
+        results = query.iter(start_cursor=self._pageCursor(request),
+                             produce_cursors=True,
+                             batch_size=SCAN_BATCH_SIZE)
+        entities = []
+        scanned = 0
+        for entity in results:
+            scanned += 1
+            if accept(entity):
+                entities.append(entity)
+            if len(entities) == page_size or scanned == MAX_SCAN_PER_PAGE:
+                # stopped early; continue from here next time
+                return entities, results.cursor_after().urlsafe()
+        return entities, None
+
+# - - - Summary views - - - - - - - - - - - - - - - - - - -
+
+    def _summaryProjection(self, request, fields, equalities=None):
+        """Return (projection, fixed) for a list request: None, None
+           unless view=SUMMARY; otherwise the summary fields to project,
+           and the values of those pinned by equality filters (the
+           datastore won't project a property filtered by equality)."""
+        if request.view != ListView.SUMMARY:
+            return None, None
+        fixed = dict((field, value)
+                     for field, value in (equalities or {}).items()
+                     if field in fields)
+        return [f for f in fields if f not in fixed], fixed
+
+    def _sessionForms(self, sessions, next_token, request, fixed=None):
+        """Return SessionForms with full items, or summaries for
+           view=SUMMARY."""
+        if request.view == ListView.SUMMARY:
+            return SessionForms(
+                summaries=[SESSION_SUMMARY_PLAN.copy(session, fixed)
+                           for session in sessions],
+                nextPageToken=next_token)
+        return SessionForms(items=[self._copySessionToForm(session)
+                                   for session in sessions],
+                            nextPageToken=next_token)
+
+    def _conferenceSummaries(self, conferences, next_token, fixed=None):
+        """Return ConferenceForms holding summaries only; summaries carry
+           no organiser name, so no Profile lookup is needed."""
+        return ConferenceForms(
+            summaries=[CONFERENCE_SUMMARY_PLAN.copy(conf, fixed)
+                       for conf in conferences],
+            nextPageToken=next_token)
+
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
     def _copyConferenceToForm(self, conf, displayName):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+        cf = CONFERENCE_PLAN.copy(conf)
         if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
+            cf.organizerDisplayName = displayName
         return cf
 
     def _createConferenceObject(self, request):
@@ -197,23 +417,91 @@ class ConferenceApi(remote.Service):
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
         # generate Profile Key based on user ID and Conference
-        # ID based on Profile key get Conference key from ID
+        # Key from a pooled ID under the Profile key
         p_key = ndb.Key(Profile, user_id)
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
-        c_key = ndb.Key(Conference, c_id, parent=p_key)
+        c_key = ndb.Key(Conference, idpool.conferenceIds.next(),
+                        parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
 
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-                              'conferenceInfo': repr(request)},
-                      url='/tasks/send_confirmation_email')
+        # create Conference and its seat shards, send email to organizer
+        # confirming creation of Conference & return (modified)
+        # ConferenceForm
+        conf = Conference(**data)
+        self._putConferenceAsync(conf, user.email(), repr(request)
+                                 ).get_result()
+        cache.invalidateQueries()
+        # a new conference is in no nearly sold out set yet
+        if soldout.isNearlySoldOut(conf.seatsAvailable):
+            soldout.update(conf, conf.seatsAvailable)
         return request
 
-    @ndb.transactional()
+    @ndb.tasklet
+    def _putConferenceAsync(self, conf, email, info):
+        """Write a new Conference, its seat shards and its confirmation
+           email with the RPCs overlapped: the shard puts run alongside
+           a transaction that puts the Conference and enqueues the email
+           concurrently, so the email is queued iff the Conference is
+           written."""
+        @ndb.transactional_tasklet
+        def txn():
+            yield (conf.put_async(),
+                   mailer.enqueueTransactionalAsync(
+                       email, 'You created a new Conference!',
+                       'Hi, you have created a following '
+                       'conference:\r\n\r\n%s' % info,
+                       'conference-created-%s' % conf.key.urlsafe()))
+
+        # shards are root entities outside the transaction; any that
+        # fail to write are recreated from the Conference by getShards
+        shards = ndb.put_multi_async(seats.newShards(conf.key,
+                                                     conf.seatsAvailable))
+        yield txn()
+        index = confsearch.indexConferencesAsync([conf])
+        counts = facets.changeAsync(facets.snapshot(None),
+                                    facets.snapshot(conf))
+        try:
+            yield shards
+        except Exception:
+            logging.warning('seat shards for %s not written',
+                            conf.key.urlsafe(), exc_info=True)
+        yield mailer.scheduleDrainAsync()
+        try:
+            yield counts
+        except Exception:
+            # the daily facets rebuild recounts it
+            logging.warning('facet counts for %s not updated',
+                            conf.key.urlsafe(), exc_info=True)
+        index()
+
     def _updateConferenceObject(self, request):
+        conf, seat_change, before = self._updateConferenceTransaction(
+            request)
+        # after the transaction, not in call_on_commit callbacks: those
+        # run in the finished transaction's context, where any datastore
+        # call fails
+        self._afterUpdate('sold-out set', conf.key,
+                          lambda: soldout.update(conf, conf.seatsAvailable))
+        self._afterUpdate('search document', conf.key,
+                          lambda: confsearch.indexConferences([conf]))
+        # the daily facets rebuild recounts it if this fails
+        self._afterUpdate('facet counts', conf.key,
+                          lambda: facets.change(before,
+                                                facets.snapshot(conf)))
+        if seat_change:
+            # added to (or taken from) the shards as a change, outside
+            # the transaction, so registrations taken since the last
+            # reconcile are kept; the reconcile then folds the shard
+            # totals back into seatsAvailable
+            seats.addSeats(conf, seat_change)
+            seats.scheduleReconcile(conf.key)
+        prof = ndb.Key(Profile, conf.organizerUserId).get()
+        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+
+    @ndb.transactional()
+    def _updateConferenceTransaction(self, request):
+        """Update a Conference; return it, the change made to its
+           seatsAvailable and its facets snapshot from before."""
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
@@ -235,6 +523,8 @@ class ConferenceApi(remote.Service):
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
+        before = facets.snapshot(conf)
+        seats_before = conf.seatsAvailable or 0
 
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
@@ -250,8 +540,18 @@ class ConferenceApi(remote.Service):
                 # write to Conference object
                 setattr(conf, field.name, data)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        cache.invalidateConference(conf.key)
+        return conf, (conf.seatsAvailable or 0) - seats_before, before
+
+    @staticmethod
+    def _afterUpdate(what, c_key, callback):
+        """Run callback for a committed update; a failure is logged
+        rather than failing a request whose write is done."""
+        try:
+            callback()
+        except Exception:
+            logging.warning('%s for %s not updated', what,
+                            c_key.urlsafe(), exc_info=True)
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
                       http_method='POST', name='createConference')
@@ -271,17 +571,26 @@ class ConferenceApi(remote.Service):
                       http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        return self._getConferenceAsync(request).get_result()
+
+    @ndb.tasklet
+    def _getConferenceAsync(self, request):
+        """Tasklet fetching a Conference and its organiser together."""
+        # the organiser's Profile is the Conference's parent, so both
+        # gets can be in flight at once
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        conf, prof = yield (cache.getConferenceAsync(c_key),
+                            c_key.parent().get_async())
+        # bail if not found
         if not conf:
             raise endpoints.NotFoundException("No conference found with"
                                               " key: %s"
                                               % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        raise ndb.Return(self._copyConferenceToForm(
+            conf, getattr(prof, 'displayName')))
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(CONF_LIST_GET_REQUEST, ConferenceForms,
                       path='getConferencesCreated',
                       http_method='POST', name='getConferencesCreated')
     def getConferencesCreated(self, request):
@@ -294,34 +603,52 @@ class ConferenceApi(remote.Service):
 
         # create ancestor query for all key matches for this user
         confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
+        projection, fixed = self._summaryProjection(
+            request, CONFERENCE_SUMMARY_FIELDS)
+        confs, next_token = self._fetchPage(confs, request, projection)
+        if projection:
+            return self._conferenceSummaries(confs, next_token, fixed)
         prof = ndb.Key(Profile, user_id).get()
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
             items=[self._copyConferenceToForm(conf,
                                               getattr(prof, 'displayName'))
-                   for conf in confs]
+                   for conf in confs],
+            nextPageToken=next_token
         )
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
-
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
-
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"],
-                                                   filtr["operator"],
-                                                   filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+    def _fetchPlannedPage(self, query_plan, request, projection):
+        """Fetch one page of a planned conference query; return
+           (conferences, nextPageToken).  Only a SCAN without residual
+           uses the projection (its index is one tools/gen_indexes.py
+           emits); other plans fetch full entities."""
+        accept = lambda conf: confquery.matches(conf, query_plan.residual)
+        q = query_plan.query()
+        if query_plan.kind == confquery.SCAN:
+            if query_plan.residual:
+                return self._fetchFilteredPage(q, request, accept)
+            return self._fetchPage(q, request, projection)
+
+        # JOIN: the merge join yields keys in key order; a small result
+        # set is sorted in memory and paged by offset, a larger one is
+        # paged in key order with a cursor
+        token = request.pageToken
+        if not token or token.isdigit():
+            keys = q.fetch(confquery.SORT_LIMIT + 1, keys_only=True)
+            if len(keys) <= confquery.SORT_LIMIT:
+                conferences = sorted(
+                    (conf for conf in ndb.get_multi(keys)
+                     if conf and accept(conf)),
+                    key=query_plan.sortKey)
+                return self._fetchListPage(conferences, request)
+            if token:
+                # grew past SORT_LIMIT since the earlier pages, which
+                # were in name order; key order would repeat some of
+                # them and skip others
+                raise endpoints.BadRequestException(
+                    "The results changed order while paging; query "
+                    "again without pageToken.")
+        return self._fetchFilteredPage(q, request, accept)
 
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
@@ -353,6 +680,15 @@ class ConferenceApi(remote.Service):
                 else:
                     inequality_field = filtr["field"]
 
+            # type values now, so equal filters always format the same
+            if filtr["field"] in ["month", "maxAttendees"]:
+                try:
+                    filtr["value"] = int(filtr["value"])
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "Filter on %s needs an integer value."
+                        % filtr["field"])
+
             formatted_filters.append(filtr)
         return (inequality_field, formatted_filters)
 
@@ -361,45 +697,119 @@ class ConferenceApi(remote.Service):
                       http_method='POST',
                       name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId))
-                      for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        """Query for conferences.  Without equality filters they are
+        ordered by the inequality property, or by name with no filters
+        at all, then by key.  With equality filters, up to 200 matches
+        are ordered by the inequality property (if any), then name;
+        more come back in key order."""
+        inequality_filter, filters = self._formatFilters(request.filters)
 
+        # popular filter sets are served straight from memcache
+        query_id = cache.queryId(filters, request.pageSize,
+                                 request.pageToken, str(request.view))
+        data, generation = cache.getQueryResult(query_id)
+        if data is not None:
+            return protobuf.decode_message(ConferenceForms, data)
+
+        # planned to run on built-in indexes; summaries copy the same
+        # way from projected and full entities
+        projection, _ = self._summaryProjection(request,
+                                                CONFERENCE_SUMMARY_FIELDS)
+        conferences, next_token = self._fetchPlannedPage(
+            confquery.plan(inequality_filter, filters), request, projection)
+        if request.view == ListView.SUMMARY:
+            forms = self._conferenceSummaries(conferences, next_token)
+        else:
+            forms = self._copyConferencesToForms(conferences, next_token)
+        cache.setQueryResult(query_id, generation,
+                             protobuf.encode_message(forms))
+        return forms
+
+    @endpoints.method(message_types.VoidMessage, ConferenceFacetsForm,
+                      path='conferences/facets',
+                      http_method='GET', name='getConferenceFacets')
+    def getConferenceFacets(self, request):
+        """Return conference counts and remaining seats per city, topic
+        and month, largest first (up to a minute old)."""
+        counts = facets.getFacets()
+
+        def forms(facet):
+            return [FacetValueForm(value=value, conferences=conferences,
+                                   seatsAvailable=seats)
+                    for value, conferences, seats in counts[facet]]
+        return ConferenceFacetsForm(cities=forms('city'),
+                                    topics=forms('topics'),
+                                    months=forms('month'))
+
+    @endpoints.method(ConferenceSearchForm, ConferenceForms,
+                      path='searchConferences',
+                      http_method='POST',
+                      name='searchConferences')
+    def searchConferences(self, request):
+        """Full-text search of conferences, best matches first; fields
+        restricts which of name, description, city and topics the
+        query terms are matched against."""
+        if not request.query:
+            raise endpoints.BadRequestException("'query' field required")
+        for field in request.fields:
+            if field not in confsearch.SEARCH_FIELDS:
+                raise endpoints.BadRequestException(
+                    "Can't search on field: %s" % field)
+
+        try:
+            wscks, next_token = confsearch.search(
+                confsearch.restrict(request.query, request.fields),
+                self._pageSize(request), request.pageToken)
+        except (search.QueryError, ValueError):
+            raise endpoints.BadRequestException(
+                "Invalid search query or pageToken.")
+
+        # one batch get per page, in rank order; skip any conference
+        # that no longer exists rather than failing the page
+        conferences = [conf for conf in ndb.get_multi(
+            [ndb.Key(urlsafe=wsck) for wsck in wscks]) if conf]
+        if request.view == ListView.SUMMARY:
+            return self._conferenceSummaries(conferences, next_token)
+        return self._copyConferencesToForms(conferences, next_token)
+
+    def _copyConferencesToForms(self, conferences, next_token=None):
+        """Copy a list of Conferences to ConferenceForms, fetching every
+           distinct organiser's displayName with one batch get."""
+        # many conferences share an organiser; only fetch each one once
+        organisers = list(set(ndb.Key(Profile, conf.organizerUserId)
+                              for conf in conferences))
+        return self._copyConferencesWithOrganisers(
+            conferences, ndb.get_multi(organisers), next_token)
+
+    def _copyConferencesWithOrganisers(self, conferences, profiles,
+                                       next_token=None):
+        """Copy Conferences to ConferenceForms given organiser Profiles."""
         # put display names in a dict for easier fetching
         names = {}
         for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+            if profile:
+                names[profile.key.id()] = profile.displayName
 
         # return individual ConferenceForm object per Conference
         return ConferenceForms(items=[self._copyConferenceToForm(conf,
-                                      names[conf.organizerUserId])
-                                      for conf in conferences])
+                                      names.get(conf.organizerUserId))
+                                      for conf in conferences],
+                               nextPageToken=next_token)
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
     def _copyProfileToForm(self, prof):
         """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize,
-                                                    getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
-        return pf
+        return PROFILE_PLAN.copy(prof)
 
     def _getProfileFromUser(self):
         """Return user Profile from datastore,
            creating new one if non-existent."""
+        return self._getProfileFromUserAsync().get_result()
+
+    @ndb.tasklet
+    def _getProfileFromUserAsync(self):
+        """Tasklet version of _getProfileFromUser()."""
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
@@ -408,16 +818,16 @@ class ConferenceApi(remote.Service):
         # get Profile from datastore
         user_id = getUserId(user)
         p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        profile = yield p_key.get_async()
         # create new Profile if not there
         if not profile:
             profile = Profile(key=p_key,
                               displayName=user.nickname(),
                               mainEmail=user.email(),
                               teeShirtSize=str(TeeShirtSize.NOT_SPECIFIED),)
-            profile.put()
+            yield profile.put_async()
 
-        return profile      # return Profile
+        raise ndb.Return(profile)      # return Profile
 
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
@@ -436,6 +846,9 @@ class ConferenceApi(remote.Service):
                         #else:
                         #    setattr(prof, field, val)
                         prof.put()
+                        if field == 'displayName':
+                            # cached query results carry organiser names
+                            cache.invalidateQueries()
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
@@ -456,33 +869,20 @@ class ConferenceApi(remote.Service):
 
     def _copySessionToForm(self, session):
         """Copy relevant fields from Session to SessionForm."""
-        sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(session, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('date') or field.name.endswith('Time'):
-                    setattr(sf, field.name, str(getattr(session, field.name)))
-                else:
-                    setattr(sf, field.name, getattr(session, field.name))
-            elif field.name == "websafeKey":
-                setattr(sf, field.name, session.key.urlsafe())
-        sf.check_initialized()
-        return sf
+        return SESSION_PLAN.copy(session)
 
-    def _createSessionObject(self, request):
-        """Create or update Session object, returning
-           SessionForm/request."""
+    def _getOwnedConference(self, request):
+        """Return (user_id, Conference) for the request's conference,
+           checking that the user is logged in and owns it."""
         # preload necessary data items
         user = endpoints.get_current_user()
         if not user:
             raise endpoints.UnauthorizedException('Authorization required')
         user_id = getUserId(user)
 
-        if not request.name:
-            raise endpoints.BadRequestException("Session 'name' "
-                                                "field required")
         # only existing conferences can have sessions: do query and check
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        conf = cache.getConference(
+            ndb.Key(urlsafe=request.websafeConferenceKey))
         # check that conference exists
         if not conf:
             raise endpoints.NotFoundException("No conference found with "
@@ -493,11 +893,13 @@ class ConferenceApi(remote.Service):
         if user_id != conf.organizerUserId:
             raise endpoints.ForbiddenException(
                 'Only the owner can create a session.')
+        return user_id, conf
 
+    def _sessionData(self, form):
+        """Copy a SessionForm into a dict of Session properties."""
         # copy SessionForm/ProtoRPC Message into dict
-        data = {field.name: getattr(request, field.name)
-                for field in request.all_fields()}
-        del data['websafeConferenceKey']
+        data = {field.name: getattr(form, field.name)
+                for field in SessionForm.all_fields()}
         del data['websafeKey']
 
         # add default values for those missing
@@ -505,7 +907,7 @@ class ConferenceApi(remote.Service):
         for df in SESSION_DEFAULTS:
             if data[df] in (None, []):
                 data[df] = SESSION_DEFAULTS[df]
-                setattr(request, df, SESSION_DEFAULTS[df])
+                setattr(form, df, SESSION_DEFAULTS[df])
 
         # convert dates from strings to Date objects
         if data['date']:
@@ -515,6 +917,16 @@ class ConferenceApi(remote.Service):
         if data['startTime']:
             data['startTime'] = datetime.strptime(data['startTime'][:10],
                                                   "%H:%M").time()
+        return data
+
+    def _createSessionObject(self, request):
+        """Create or update Session object, returning
+           SessionForm/request."""
+        if not request.name:
+            raise endpoints.BadRequestException("Session 'name' "
+                                                "field required")
+        user_id, conf = self._getOwnedConference(request)
+        data = self._sessionData(request)
 
         # generate Session Key based on Conference ID
         c_key = conf.key
@@ -525,14 +937,97 @@ class ConferenceApi(remote.Service):
         data['organizerUserId'] = request.organizerUserId = user_id
 
         # create Session and return (modified) SessionForm
-        Session(**data).put()
+        session = Session(**data)
+        self._putSessions(c_key, [session])
 
         # add a task to set the featured speaker
-        taskqueue.add(params={'speaker': data['speaker'],
-                              'c_key': request.websafeConferenceKey},
-                      url='/tasks/set_featured_speaker')
+        self._queueFeaturedSpeaker(c_key)
 
-        return self._copySessionToForm(s_key.get())
+        return self._copySessionToForm(session)
+
+    def _createSessionObjects(self, request):
+        """Create a batch of Session objects, returning SessionForms."""
+        if len(request.items) > MAX_SESSIONS_PER_BATCH:
+            raise endpoints.BadRequestException(
+                "At most %d sessions per batch." % MAX_SESSIONS_PER_BATCH)
+        if not all(form.name for form in request.items):
+            raise endpoints.BadRequestException("Session 'name' "
+                                                "field required")
+        # one owner check for the whole batch
+        user_id, conf = self._getOwnedConference(request)
+        if not request.items:
+            return SessionForms()
+
+        # allocate a block of Session IDs in one call
+        c_key = conf.key
+        first, last = Session.allocate_ids(size=len(request.items),
+                                           parent=c_key)
+        sessions = []
+        for s_id, form in zip(range(first, last + 1), request.items):
+            data = self._sessionData(form)
+            data['key'] = ndb.Key(Session, s_id, parent=c_key)
+            data['organizerUserId'] = user_id
+            sessions.append(Session(**data))
+        self._putSessions(c_key, sessions)
+
+        # one featured speaker recomputation for the whole batch
+        self._queueFeaturedSpeaker(c_key)
+
+        return SessionForms(items=[self._copySessionToForm(session)
+                                   for session in sessions])
+
+    @staticmethod
+    @ndb.transactional()
+    def _putSessions(c_key, sessions):
+        """Write a conference's new sessions and add them to its Speaker
+           index; both live in the conference's entity group."""
+        by_speaker = {}
+        for session in sessions:
+            if session.speaker:
+                by_speaker.setdefault(session.speaker, []).append(session)
+
+        sp_keys = [ndb.Key(Speaker, name, parent=c_key)
+                   for name in by_speaker]
+        speakers = []
+        for sp_key, speaker in zip(sp_keys, ndb.get_multi(sp_keys)):
+            speaker = speaker or Speaker(key=sp_key, name=sp_key.id())
+            for session in by_speaker[sp_key.id()]:
+                speaker.sessionKeys.append(session.key)
+                speaker.sessionNames.append(session.name)
+            speakers.append(speaker)
+        ndb.put_multi(sessions + speakers)
+
+    @staticmethod
+    @ndb.transactional()
+    def _rebuildSpeakers(c_key):
+        """Rebuild a conference's Speaker index from its sessions; for
+           conferences whose sessions predate the index."""
+        speakers = {}
+        for session in Session.query(ancestor=c_key):
+            if session.speaker:
+                speaker = speakers.setdefault(session.speaker, Speaker(
+                    key=ndb.Key(Speaker, session.speaker, parent=c_key),
+                    name=session.speaker))
+                speaker.sessionKeys.append(session.key)
+                speaker.sessionNames.append(session.name)
+        stale = [sp_key for sp_key in
+                 Speaker.query(ancestor=c_key).fetch(keys_only=True)
+                 if sp_key.id() not in speakers]
+        ndb.delete_multi(stale)
+        ndb.put_multi(speakers.values())
+
+    @staticmethod
+    def _backfillSpeakers(cursor=None):
+        """Rebuild the Speaker index of one batch of Conferences whose
+        sessions may predate it; requeue for the next batch.
+        """
+        c_keys, next_cursor, more = Conference.query().fetch_page(
+            BACKFILL_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+        for c_key in c_keys:
+            ConferenceApi._rebuildSpeakers(c_key)
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/rebuild_speakers')
 
     @endpoints.method(SESS_POST_REQUEST, SessionForm,
                       path='session/{websafeConferenceKey}',
@@ -541,6 +1036,13 @@ class ConferenceApi(remote.Service):
         """Create new session."""
         return self._createSessionObject(request)
 
+    @endpoints.method(SESSIONS_POST_REQUEST, SessionForms,
+                      path='session/{websafeConferenceKey}/batch',
+                      http_method='POST', name='createSessions')
+    def createSessions(self, request):
+        """Create a batch of new sessions."""
+        return self._createSessionObjects(request)
+
     @endpoints.method(SESS_GET_REQUEST, SessionForms,
                       path='sessions/get',
                       http_method='GET', name='getConferenceSessions')
@@ -550,11 +1052,11 @@ class ConferenceApi(remote.Service):
         # create ancestor query for all key matches for this conference
         c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
         sessions = Session.query(ancestor=c_key)
+        projection, fixed = self._summaryProjection(request,
+                                                    SESSION_SUMMARY_FIELDS)
+        sessions, next_token = self._fetchPage(sessions, request, projection)
         # return set of SessionForm objects per Conference
-        return SessionForms(
-            items=[self._copySessionToForm(session)
-                   for session in sessions]
-        )
+        return self._sessionForms(sessions, next_token, request, fixed)
 
     @endpoints.method(SESS_TYPE_GET_REQUEST, SessionForms,
                       path='sessions/{websafeConferenceKey}/{typeOfSession}',
@@ -565,14 +1067,15 @@ class ConferenceApi(remote.Service):
         # create ancestor query for all key matches for this conference
         c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
         sessions = Session.query(ancestor=c_key)
-        listOfTypes = [request.typeOfSession]
-        sessions = sessions.filter(Session.typeOfSession
-                                          .IN(listOfTypes))
+        # equality on a repeated property matches any list member; unlike
+        # IN it stays a single query, so it can be paged with a cursor
+        sessions = sessions.filter(Session.typeOfSession ==
+                                   request.typeOfSession)
+        projection, fixed = self._summaryProjection(request,
+                                                    SESSION_SUMMARY_FIELDS)
+        sessions, next_token = self._fetchPage(sessions, request, projection)
         # return set of SessionForm objects per Conference
-        return SessionForms(
-            items=[self._copySessionToForm(session)
-                   for session in sessions]
-        )
+        return self._sessionForms(sessions, next_token, request, fixed)
 
     @endpoints.method(SESS_SPEAKER_GET_REQUEST, SessionForms,
                       path='sessions/speaker',
@@ -580,61 +1083,134 @@ class ConferenceApi(remote.Service):
     def getSessionsBySpeaker(self, request):
         """Return sessions with the given speaker."""
 
-        # query for all sessions with a given speaker
-        sessions = Session.query()
-        sessions = sessions.filter(Session.speaker ==
-                                   request.speaker)
+        # one Speaker row per conference the speaker talks at holds the
+        # keys of their sessions there
+        speakers = Speaker.query(Speaker.name == request.speaker)
+        s_keys, next_token = self._fetchNestedPage(
+            speakers.order(Speaker.key), request,
+            lambda speaker: speaker.sessionKeys)
+        sessions = [s for s in ndb.get_multi(s_keys) if s]
         # return set of SessionForm objects with that speaker
-        return SessionForms(
-            items=[self._copySessionToForm(session)
-                   for session in sessions]
-        )
+        return self._sessionForms(sessions, next_token, request)
+
+    def _legacyWishlistKeys(self, prof):
+        """Return Session keys still held in the Profile's legacy
+           wishlist lists."""
+        s_keys = list(prof.wishlist)
+        if prof.sessionsInWishlist:
+            seen = set(s_keys)
+            for wssk in prof.sessionsInWishlist:
+                s_key = ndb.Key(urlsafe=wssk)
+                if s_key not in seen:
+                    seen.add(s_key)
+                    s_keys.append(s_key)
+        return s_keys
+
+    def _wishlistEntry(self, p_key, session):
+        """Return a (new) WishlistEntry for a Session."""
+        return WishlistEntry(
+            key=ndb.Key(WishlistEntry, session.key.urlsafe(), parent=p_key),
+            sessionKey=session.key, speaker=session.speaker,
+            date=session.date, startTime=session.startTime,
+            typeOfSession=session.typeOfSession)
+
+    def _migrateWishlist(self, prof):
+        """Move a Profile's legacy wishlist lists into WishlistEntry
+           children; a no-op once migrated."""
+        s_keys = self._legacyWishlistKeys(prof)
+        if s_keys:
+            sessions = [s for s in ndb.get_multi(s_keys) if s]
+            self._storeMigratedWishlist(prof.key, sessions)
+
+    @ndb.transactional()
+    def _storeMigratedWishlist(self, p_key, sessions):
+        prof = p_key.get()
+        ndb.put_multi([self._wishlistEntry(p_key, session)
+                       for session in sessions])
+        prof.sessionsInWishlist = []
+        prof.wishlist = []
+        prof.wishlistVersion += 1
+        prof.put()
 
     def _addToWishlist(self, request, add=True):
         """Adds or delete from the user's wishlist sessions."""
+        return self._addToWishlistAsync(request, add).get_result()
 
-        #get profile from user and sessionKey from request
-        prof = self._getProfileFromUser()
-        s_key = request.sessionKey
-
-        #check to see if session is valid
-        # and if user already added this session
-        session = ndb.Key(urlsafe=s_key).get()
+    @ndb.tasklet
+    def _addToWishlistAsync(self, request, add):
+        """Tasklet version of _addToWishlist()."""
+        #get profile from user and sessionKey from request, and
+        # check to see if session is valid, all at once
+        s_key = ndb.Key(urlsafe=request.sessionKey)
+        prof, session = yield (self._getProfileFromUserAsync(),
+                               s_key.get_async())
 
         if not session:
             raise endpoints.NotFoundException(
-                'No session found with key: %s' % s_key)
+                'No session found with key: %s' % request.sessionKey)
+        self._migrateWishlist(prof)
+        delta = yield self._updateWishlistAsync(prof.key, session, add)
+        raise ndb.Return(delta)
+
+    @ndb.transactional_tasklet
+    def _updateWishlistAsync(self, p_key, session, add):
+        """Add or remove one session; return only the change."""
+        entry = self._wishlistEntry(p_key, session)
+        prof, existing = yield p_key.get_async(), entry.key.get_async()
+        delta = WishlistDeltaForm()
+
         if add:
-            if s_key in prof.sessionsInWishlist:
+            if existing:
                 raise ConflictException(
                     "You have already added this session in your wishlist")
-            else:
-                prof.sessionsInWishlist.append(s_key)
-        else:
-            if s_key in prof.sessionsInWishlist:
-                prof.sessionsInWishlist.remove(s_key)
-        prof.put()
-        session_keys = [ndb.Key(urlsafe=wssk)
-                        for wssk in prof.sessionsInWishlist]
-        sessions = ndb.get_multi(session_keys)
-
-        return SessionForms(items=[self._copySessionToForm(session)
-                            for session in sessions])
+            delta.added = [session.key.urlsafe()]
+            yield entry.put_async()
+        elif existing:
+            delta.removed = [session.key.urlsafe()]
+            yield entry.key.delete_async()
+
+        if delta.added or delta.removed:
+            prof.wishlistVersion += 1
+            yield prof.put_async()
+        delta.version = prof.wishlistVersion
+        raise ndb.Return(delta)
+
+    def _wishlistSessions(self, speaker=None, date=None, typeOfSession=None):
+        """Return the user's wishlist Sessions, optionally filtered; the
+           filters are ancestor queries on the denormalized entries."""
+        prof = self._getProfileFromUser()  # get user Profile
+        self._migrateWishlist(prof)
 
-    @endpoints.method(WISHLIST_GET_REQUEST, SessionForms,
+        entries = WishlistEntry.query(ancestor=prof.key)
+        if speaker:
+            entries = entries.filter(WishlistEntry.speaker == speaker)
+        if date:
+            try:
+                date = datetime.strptime(date[:10], "%Y-%m-%d").date()
+            except ValueError:
+                raise endpoints.BadRequestException(
+                    "Invalid date: %s (expected YYYY-MM-DD)" % date)
+            entries = entries.filter(WishlistEntry.date == date)
+        if typeOfSession:
+            entries = entries.filter(
+                WishlistEntry.typeOfSession == typeOfSession)
+        sessions = ndb.get_multi([entry.sessionKey for entry in entries])
+        return [session for session in sessions if session]
+
+    @endpoints.method(WISHLIST_GET_REQUEST, WishlistDeltaForm,
                       path='sessions/wishlist/add',
                       http_method='POST', name='addSessionsToWishlist')
     def addSessionsToWishlist(self, request):
-        """Return Sessions in WishList for the profile user.
-           Returns the user's updated wishlist."""
+        """Add a Session to the profile user's WishList.
+           Returns the change and the new wishlist version."""
         return self._addToWishlist(request, True)
 
-    @endpoints.method(WISHLIST_GET_REQUEST, SessionForms,
+    @endpoints.method(WISHLIST_GET_REQUEST, WishlistDeltaForm,
                       path='sessions/wishlist/delete',
                       http_method='DELETE', name='deleteSessionInWishlist')
     def deleteSessionInWishlist(self, request):
         """Deletes a Session in WishList for the profile user.
-            Returns the user's updated wishlist."""
+            Returns the change and the new wishlist version."""
         return self._addToWishlist(request, False)
 
     @endpoints.method(message_types.VoidMessage, SessionForms,
@@ -642,12 +1218,17 @@ class ConferenceApi(remote.Service):
                       http_method='GET', name='getSessionsInWishlist')
     def getSessionsInWishlist(self, request):
         """Get list of sessions that user has added to wishlist."""
-        prof = self._getProfileFromUser()  # get user Profile
-        s_keys = [ndb.Key(urlsafe=wssk)
-                  for wssk in prof.sessionsInWishlist]
-        sessions = ndb.get_multi(s_keys)
-
         # return set of SessionForm objects per Session
+        return SessionForms(items=[self._copySessionToForm(session)
+                                   for session in self._wishlistSessions()])
+
+    @endpoints.method(WISHLIST_QUERY_GET_REQUEST, SessionForms,
+                      path='sessions/wishlist/query',
+                      http_method='GET', name='queryWishlist')
+    def queryWishlist(self, request):
+        """Get wishlist sessions by speaker, date and/or typeOfSession."""
+        sessions = self._wishlistSessions(request.speaker, request.date,
+                                          request.typeOfSession)
         return SessionForms(items=[self._copySessionToForm(session)
                                    for session in sessions])
 
@@ -667,23 +1248,18 @@ class ConferenceApi(remote.Service):
         # get all sessions by the specified start time
         sessions = sessions.filter(Session.startTime ==
                                    startTime)
+        projection, fixed = self._summaryProjection(
+            request, SESSION_SUMMARY_FIELDS, {'startTime': startTime})
+        sessions, next_token = self._fetchPage(sessions, request, projection)
         # return set of SessionForm objects with startTime
-        return SessionForms(
-            items=[self._copySessionToForm(session)
-                   for session in sessions]
-        )
+        return self._sessionForms(sessions, next_token, request, fixed)
 
     @endpoints.method(WISHLIST_SPEAKER_GET_REQUEST, SessionForms,
                       path='sessions/wishlist/speaker',
                       http_method='GET', name='getSessionsInWishlistBySpeaker')
     def getSessionsInWishlistBySpeaker(self, request):
         """Get list of sessions that user has added to wishlist by speaker."""
-        prof = self._getProfileFromUser()  # get user Profile
-        s_keys = [ndb.Key(urlsafe=wssk)
-                  for wssk in prof.sessionsInWishlist]
-        sessions = ndb.get_multi(s_keys)
-
-        sessions = [s for s in sessions if request.speaker == s.speaker]
+        sessions = self._wishlistSessions(speaker=request.speaker)
 
         # return set of SessionForm objects per Session
         return SessionForms(items=[self._copySessionToForm(session)
@@ -695,24 +1271,9 @@ class ConferenceApi(remote.Service):
         """Create Announcement & assign to memcache; used by
         memcache cron job & putAnnouncement().
         """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
-
-        return announcement
+        # the nearly sold out set is kept up to date as seats change;
+        # rebuilding it from the datastore corrects any drift
+        return soldout.rebuild()
 
     @endpoints.method(message_types.VoidMessage, StringMessage,
                       path='conference/announcement/get',
@@ -723,37 +1284,63 @@ class ConferenceApi(remote.Service):
                              or "")
 
     @staticmethod
-    def _speakerAnnouncement(c_key, speaker):
-        """Create Featured Speaker Announcement & assign to
-        memcache; used by memcache cron job.
+    def _queueFeaturedSpeaker(c_key):
+        """Queue a featured speaker recomputation for a conference.
+        Tasks are named per conference and time window, so a burst of
+        new sessions for one conference queues a single task.
+        """
+        wsck = c_key.urlsafe()
+        window = int(time.time()) // FEATURED_SPEAKER_DELAY
+        try:
+            taskqueue.add(name='featured-%s-%d' % (wsck, window),
+                          params={'c_key': wsck},
+                          url='/tasks/set_featured_speaker',
+                          countdown=FEATURED_SPEAKER_DELAY)
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
+
+    @staticmethod
+    def _speakerAnnouncement(wsck):
+        """Create Featured Speaker Announcement for a conference &
+        assign to memcache; used by the featured speaker task.
         """
         announcement = ""
 
-        wsck = ndb.Key(urlsafe=c_key)
-        # check to see if this speaker has more than one session
-        sessions = Session.query(ancestor=wsck)
-        sessions = sessions.filter(Session.speaker == speaker)
+        c_key = ndb.Key(urlsafe=wsck)
+        # the conference's Speaker index has every speaker's session
+        # count and names; one ancestor query covers them all
+        speakers = [sp for sp in Speaker.query(ancestor=c_key)
+                    if sp.numSessions > 1]
 
-        # if this speaker already has a session, then he/she becomes
-        # the featured speaker. Concatenate all the session names and
-        # create a announcement with the featured speaker.
+        # a speaker with more than one session can be the featured
+        # speaker; feature the busiest one. Concatenate all the session
+        # names and create a announcement with the featured speaker.
         # Set the memcache with the announcement.
-        if sessions.count() > 1:
+        if speakers:
+            sp = max(speakers, key=lambda sp: (sp.numSessions, sp.name))
             announcement = ANNOUNCEMENT_FEATURED_SPEAKER % \
-                (speaker, ', '.join(s.name for s in sessions))
-            memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, announcement)
+                (sp.name, ', '.join(sp.sessionNames))
+        memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY % wsck, announcement)
+        return announcement
 
-    @endpoints.method(message_types.VoidMessage, StringMessage,
+    @endpoints.method(CONF_GET_REQUEST, StringMessage,
                       path='sessions/featured/get',
                       http_method='GET', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
-        """Return Featured Speaker from memcache."""
-        featured = memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY)
+        """Return a conference's Featured Speaker from memcache."""
+        wsck = request.websafeConferenceKey
+        if not wsck:
+            raise endpoints.BadRequestException(
+                "websafeConferenceKey is required.")
+        featured = memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY % wsck)
+        if featured is None:
+            # evicted (or never computed); rebuild it from the index
+            featured = self._speakerAnnouncement(wsck)
         return StringMessage(data=featured or "")
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
         retval = None
@@ -762,11 +1349,45 @@ class ConferenceApi(remote.Service):
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
         wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        conf = cache.getConference(ndb.Key(urlsafe=wsck))
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
+        # seats live in shards: try shards that looked like they had
+        # seats until one transaction takes (or gives back) a seat
+        shards = seats.getShards(conf)
+        if reg:
+            shard_keys = seats.reserveOrder(shards)
+        else:
+            shard_keys = seats.releaseOrder(shards)
+        for shard_key in shard_keys:
+            retval = self._registrationTransaction(prof.key, wsck,
+                                                   shard_key, reg)
+            if retval is not None:
+                break
+        else:
+            raise ConflictException(
+                "There are no seats available.")
+
+        if retval:
+            seats.scheduleReconcile(conf.key)
+            # estimate the new total from the shards read above so the
+            # announcement follows straight away; the reconcile task
+            # corrects it with the exact total
+            estimate = sum(shard.seatsAvailable for shard in shards)
+            soldout.update(conf, estimate - 1 if reg else estimate + 1)
+        return BooleanMessage(data=retval)
+
+    @ndb.transactional(xg=True)
+    def _registrationTransaction(self, p_key, wsck, shard_key, reg):
+        """Move one seat between a seat shard and the user's Profile,
+           and write or delete the user's Registration (which lives in
+           the Profile's entity group) to match; return None if the
+           shard has run out of seats."""
+        prof, shard = ndb.get_multi([p_key, shard_key])
+        r_key = ndb.Key(Registration, wsck, parent=p_key)
+
         # register
         if reg:
             # check if user already registered otherwise add
@@ -774,57 +1395,116 @@ class ConferenceApi(remote.Service):
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
+            # check if seats avail in this shard
+            if shard.seatsAvailable <= 0:
+                return None
 
             # register user, take away one seat
             prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
+            shard.seatsAvailable -= 1
+            ndb.put_multi([prof, shard, Registration(
+                key=r_key, conference=ndb.Key(urlsafe=wsck))])
 
         # unregister
         else:
             # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            if wsck not in prof.conferenceKeysToAttend:
+                return False
+
+            # unregister user, add back one seat
+            prof.conferenceKeysToAttend.remove(wsck)
+            shard.seatsAvailable += 1
+            ndb.put_multi([prof, shard])
+            r_key.delete()
+
+        # things were written back to the datastore above; return
+        return True
+
+    @endpoints.method(CONF_ATTENDEES_GET_REQUEST, AttendeeForms,
+                      path='conference/{websafeConferenceKey}/attendees',
+                      http_method='GET', name='getConferenceAttendees')
+    def getConferenceAttendees(self, request):
+        """Return one page of a conference's attendees (owner only)."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        conf = cache.getConference(c_key)
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s'
+                % request.websafeConferenceKey)
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can see the attendees.')
+
+        # Registrations are indexed by conference; each page is one
+        # cursor query plus one batch get of the attendees' Profiles
+        registrations, next_token = self._fetchPage(
+            Registration.query(Registration.conference == c_key), request)
+        profiles = ndb.get_multi([r.key.parent() for r in registrations])
+        return AttendeeForms(
+            items=[AttendeeForm(displayName=getattr(prof, 'displayName'),
+                                mainEmail=getattr(prof, 'mainEmail'),
+                                registeredAt=str(r.registeredAt))
+                   for r, prof in zip(registrations, profiles)],
+            nextPageToken=next_token)
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
+    @staticmethod
+    def _backfillRegistrations(cursor=None):
+        """Write Registrations for one batch of Profiles registered
+        before Registrations existed; requeue for the next batch.
+        """
+        profiles, next_cursor, more = Profile.query().fetch_page(
+            BACKFILL_BATCH_SIZE, start_cursor=cursor)
+        for prof in profiles:
+            if prof.conferenceKeysToAttend:
+                ConferenceApi._backfillProfileRegistrations(prof.key)
+        if more and next_cursor:
+            taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                          url='/tasks/backfill_registrations')
 
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
-        return BooleanMessage(data=retval)
+    @staticmethod
+    @ndb.transactional()
+    def _backfillProfileRegistrations(p_key):
+        """Write the missing Registrations of one Profile, reading its
+           registrations in the same transaction so a concurrent
+           unregister can't leave one behind."""
+        prof = p_key.get()
+        r_keys = [ndb.Key(Registration, wsck, parent=p_key)
+                  for wsck in prof.conferenceKeysToAttend]
+        # only write the missing ones: rewriting an existing
+        # Registration would reset its registeredAt
+        ndb.put_multi([Registration(key=r_key,
+                                    conference=ndb.Key(urlsafe=r_key.id()))
+                       for r_key, registration
+                       in zip(r_keys, ndb.get_multi(r_keys))
+                       if registration is None])
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
                       path='conferences/attending',
                       http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
-        prof = self._getProfileFromUser()  # get user Profile
+        return self._getConferencesToAttendAsync().get_result()
+
+    @ndb.tasklet
+    def _getConferencesToAttendAsync(self):
+        """Tasklet fetching the user's conferences and their organisers."""
+        prof = yield self._getProfileFromUserAsync()  # get user Profile
         conf_keys = [ndb.Key(urlsafe=wsck)
                      for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId)
-                      for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        # organisers are the conferences' parents; fetch them alongside
+        # the conferences rather than after them
+        organisers = list(set(c_key.parent() for c_key in conf_keys))
+        conferences, profiles = yield (ndb.get_multi_async(conf_keys),
+                                       ndb.get_multi_async(organisers))
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf,
-                                      names[conf.organizerUserId])
-                                      for conf in conferences])
+        raise ndb.Return(self._copyConferencesWithOrganisers(
+            [conf for conf in conferences if conf], profiles))
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
                       path='conference/{websafeConferenceKey}',
@@ -859,6 +1539,34 @@ class ConferenceApi(remote.Service):
             items=[self._copyConferenceToForm(conf, "") for conf in q]
         )
 
+# - - - Session search - - - - - - - - - - - - - - - - - - - -
+
+    @endpoints.method(SessionQueryForms, SessionForms,
+                      path='searchSessions',
+                      http_method='POST', name='searchSessions')
+    def searchSessions(self, request):
+        """Search sessions with any mix of filters on date, startTime,
+        duration, typeOfSession and speaker, optionally within one
+        conference."""
+        filters = sessionquery.formatFilters(request.filters)
+        ancestor = None
+        if request.websafeConferenceKey:
+            ancestor = ndb.Key(urlsafe=request.websafeConferenceKey)
+        pushed, residual = sessionquery.plan(filters, ancestor is not None)
+        sessions = sessionquery.buildQuery(pushed, ancestor)
+
+        # whole entities even for view=SUMMARY: a projection of every
+        # filter shape searchSessions accepts would need a composite
+        # index per shape, each one written on every Session put
+        if residual:
+            sessions, next_token = self._fetchFilteredPage(
+                sessions, request,
+                lambda s: sessionquery.matches(s, residual))
+        else:
+            sessions, next_token = self._fetchPage(sessions, request)
+
+        return self._sessionForms(sessions, next_token, request)
+
 # - - - Query Problem with two inequalities - - - - - - - - - - - -
     @endpoints.method(message_types.VoidMessage, SessionForms,
                       path='twoInequalitiesQuery',
@@ -883,4 +1591,7 @@ class ConferenceApi(remote.Service):
         )
 
 
-api = endpoints.api_server([ConferenceApi])  # register API
+# register API, accounting for every method's RPCs (and profiling the
+# requests settings opt in)
+api = rpcstats.middleware(profiler.middleware(
+    endpoints.api_server([ConferenceApi])))
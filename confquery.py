@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""confquery.py
+
+Udacity conference server-side Python App Engine conference query planner
+
+queryConferences used to order every query by name, which needs a
+composite index for every combination of filtered properties, and every
+one of them is rewritten on each Conference put.  plan() instead picks a
+strategy the built-in single-property indexes can serve:
+
+- SCAN: with no equality filter, the query is ordered by the
+  inequality property (or by name, with no filters at all) and is
+  served by that property's built-in index; != filters are left as a
+  residual, as the datastore can only page them as several queries;
+- JOIN: equality filters are answered by merge-joining the built-in
+  indexes of their properties, in key order, with any inequality left
+  as a residual.  Result sets of up to SORT_LIMIT conferences are then
+  sorted in memory by the property SCAN would order by, then by name
+  (SCAN breaks ties by key); larger ones are paged in key order.
+
+requiredIndexes() lists the composite indexes a plan needs: only SCANs
+projected for view=SUMMARY need any.  tools/gen_indexes.py builds
+index.yaml from it for every query FIELDS and OPERATORS allow.
+
+"""
+
+from google.appengine.ext import ndb
+
+from models import Conference
+import queryfilters
+
+SCAN = 'scan'
+JOIN = 'join'
+SORT_LIMIT = 200
+
+REPEATED = ('topics',)
+
+
+class Plan(object):
+    """Plan -- how one set of formatted conference filters is run"""
+
+    def __init__(self, kind, pushed, residual, order):
+        self.kind = kind
+        self.pushed = pushed
+        self.residual = residual
+        # SCAN: the property the datastore orders by; JOIN: the
+        # property sorted on (before name) in memory, if any
+        self.order = order
+
+    def query(self):
+        """Return the Conference query for the pushed filters."""
+        q = Conference.query()
+        for filtr in self.pushed:
+            q = q.filter(ndb.query.FilterNode(filtr['field'],
+                                              filtr['operator'],
+                                              filtr['value']))
+        if self.kind == SCAN:
+            q = q.order(ndb.GenericProperty(self.order))
+        return q
+
+    def sortKey(self, conf):
+        """Key sorting JOIN results in SCAN order: order property (if
+        any), then name."""
+        if not self.order:
+            return conf.name
+        value = getattr(conf, self.order)
+        if self.order in REPEATED:
+            # the datastore sorts lists ascending by their least value
+            value = min(value) if value else None
+        return value, conf.name
+
+
+def plan(inequality_field, filters):
+    """Return the Plan for formatted filters (with at most one
+    inequality property, as _formatFilters enforces)."""
+    equalities = [f for f in filters if f['operator'] == '=']
+    if equalities:
+        return Plan(JOIN, equalities,
+                    [f for f in filters if f['operator'] != '='],
+                    inequality_field)
+
+    pushed = [f for f in filters if f['operator'] != '!=']
+    return Plan(SCAN, pushed,
+                [f for f in filters if f['operator'] == '!='],
+                inequality_field if pushed else 'name')
+
+
+def requiredIndexes(query_plan, projection=None):
+    """Return the composite indexes (tuples of property names, in index
+    order) a plan needs when run with the given projection."""
+    if query_plan.kind != SCAN or query_plan.residual or not projection:
+        # merge joins and single-property orders use built-in indexes,
+        # and only projected SCANs are run with a projection
+        return []
+    rest = sorted(set(projection) - set([query_plan.order]))
+    if not rest:
+        return []
+    return [tuple([query_plan.order] + rest)]
+
+
+def matches(conf, residual):
+    """Return True if a conference passes every residual filter, with
+    the datastore's list semantics throughout."""
+    return queryfilters.matches(conf, residual, REPEATED)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""confsearch.py
+
+Udacity conference server-side Python App Engine conference full-text
+search
+
+Every Conference has a document in the INDEX_NAME search index, with the
+conference's websafe key as its id, rewritten whenever the conference is
+created or updated.  A document put that fails is retried from a
+/tasks/index_conference task, so the index catches up with the
+datastore; the same task, without a conference key, reindexes every
+conference in batches.
+
+search() ranks matches by relevance and pages with search cursors;
+neither depends on the size of the corpus.
+
+"""
+
+import logging
+
+from google.appengine.api import search as searchapi
+from google.appengine.api import taskqueue
+
+from models import Conference
+
+INDEX_NAME = 'conferences'
+# document fields a search may be restricted to
+SEARCH_FIELDS = ('name', 'description', 'city', 'topics')
+# how many of the best matches are scored and ranked
+SCORE_LIMIT = 1000
+REINDEX_BATCH_SIZE = 100
+
+
+def _index():
+    return searchapi.Index(name=INDEX_NAME)
+
+
+def document(conf):
+    """Return the search document for a Conference."""
+    fields = [searchapi.TextField(name='name', value=conf.name),
+              searchapi.TextField(name='description',
+                                  value=conf.description or ''),
+              searchapi.TextField(name='city', value=conf.city or '')]
+    fields += [searchapi.TextField(name='topics', value=topic)
+               for topic in conf.topics or []]
+    if conf.month:
+        fields.append(searchapi.NumberField(name='month', value=conf.month))
+    if conf.startDate:
+        fields.append(searchapi.DateField(name='startDate',
+                                          value=conf.startDate))
+    return searchapi.Document(doc_id=conf.key.urlsafe(), fields=fields)
+
+
+def indexConferencesAsync(confs):
+    """Start writing the documents for Conferences; return a function
+    that waits for the write and queues a retry for any that failed."""
+    put = _index().put_async([document(conf) for conf in confs])
+
+    def wait():
+        try:
+            failed = [conf for conf, result in zip(confs, put.get_result())
+                      if result.code != searchapi.OperationResult.OK]
+        except searchapi.Error:
+            logging.warning('search index put failed', exc_info=True)
+            failed = confs
+        for conf in failed:
+            taskqueue.add(params={'c_key': conf.key.urlsafe()},
+                          url='/tasks/index_conference')
+    return wait
+
+
+def indexConferences(confs):
+    """Write the documents for Conferences, queueing a retry for any
+    that could not be written."""
+    if confs:
+        indexConferencesAsync(confs)()
+
+
+def reindex(c_key=None, cursor=None):
+    """Rewrite one Conference's document, or, without c_key, the
+    documents of one batch of Conferences, queueing the next batch."""
+    if c_key:
+        conf = c_key.get()
+        if conf:
+            _index().put(document(conf))
+        return
+    confs, next_cursor, more = Conference.query().fetch_page(
+        REINDEX_BATCH_SIZE, start_cursor=cursor)
+    if confs:
+        _index().put([document(conf) for conf in confs])
+    if more and next_cursor:
+        taskqueue.add(params={'cursor': next_cursor.urlsafe()},
+                      url='/tasks/index_conference')
+
+
+def restrict(query, fields):
+    """Return query with its terms matched against fields only."""
+    if not fields:
+        return query
+    return ' OR '.join('%s:(%s)' % (field, query) for field in fields)
+
+
+def search(query, limit, cursor=None):
+    """Return (websafe conference keys, next cursor or None) for one
+    page of the best matches for query, best first."""
+    options = searchapi.QueryOptions(
+        limit=limit,
+        cursor=searchapi.Cursor(web_safe_string=cursor) if cursor
+        else searchapi.Cursor(),
+        ids_only=True,
+        sort_options=searchapi.SortOptions(
+            match_scorer=searchapi.MatchScorer(),
+            expressions=[searchapi.SortExpression(
+                expression='_score',
+                direction=searchapi.SortExpression.DESCENDING,
+                default_value=0)],
+            limit=SCORE_LIMIT))
+    results = _index().search(searchapi.Query(query_string=query,
+                                              options=options))
+    next_cursor = results.cursor.web_safe_string if results.cursor else None
+    return [doc.doc_id for doc in results.results], next_cursor
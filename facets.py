@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+"""facets.py
+
+Udacity conference server-side Python App Engine facet counts
+
+For every city, topic and month, the number of conferences and their
+total remaining seats are kept in FacetShard counters, NUM_SHARDS per
+facet value: each change goes to a random shard in its own small
+transaction, so a popular city or topic doesn't serialise its writers
+on one entity group.  Changes are applied as the difference between a
+conference's snapshot() before and after a write: on create, on update,
+and, for seats, when registrations are reconciled into
+Conference.seatsAvailable (see seats.reconcile), which already
+coalesces a burst of registrations into one change.
+
+getFacets() sums the shards and serves the result from memcache for
+FACETS_TTL seconds.  A daily cron rebuild() recounts everything from
+the Conferences, undoing any drift from changes that failed to apply:
+REBUILD_BATCH_SIZE Conferences per task, chained by cursor, with the
+running totals kept in a FacetRebuild.  Each batch is added to the
+totals in the same transaction that advances the cursor and queues the
+next task, so a retried task can't count its batch twice.
+
+The recount doesn't overwrite the shards, which would lose the changes
+made while it ran.  It records the shard sums when it starts, and after
+the last batch applies the difference between its totals and those
+sums as an ordinary sharded change, once.  Changes made during the
+recount are kept; the only error left is a conference changed during
+the recount before its batch was counted, whose change is counted by
+both the recount and its own delta.  That window is one recount long,
+and the next rebuild corrects it.
+
+"""
+
+import collections
+import random
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import FacetRebuild
+from models import FacetShard
+
+NUM_SHARDS = 10
+MEMCACHE_FACETS_KEY = "CONFERENCE_FACETS"
+FACETS_TTL = 60         # seconds
+FACETS = ('city', 'topics', 'month')
+REBUILD_BATCH_SIZE = 500
+
+
+def snapshot(conf):
+    """Return what a conference contributes to the facets: its
+    (facet, value) memberships and its remaining seats."""
+    if conf is None:
+        return (), 0
+    memberships = set()
+    if conf.city:
+        memberships.add(('city', conf.city))
+    for topic in conf.topics or []:
+        memberships.add(('topics', topic))
+    if conf.month:
+        memberships.add(('month', str(conf.month)))
+    return tuple(sorted(memberships)), conf.seatsAvailable or 0
+
+
+def _deltas(old, new):
+    """Return {(facet, value): [conferences, seats]} moving a conference
+    from snapshot old to snapshot new, without zero changes."""
+    deltas = collections.defaultdict(lambda: [0, 0])
+    for (memberships, seats), sign in ((old, -1), (new, 1)):
+        for membership in memberships:
+            deltas[membership][0] += sign
+            deltas[membership][1] += sign * seats
+    return dict((membership, delta) for membership, delta in deltas.items()
+                if delta != [0, 0])
+
+
+@ndb.transactional_tasklet
+def _applyAsync(facet, value, conferences, seats):
+    """Add to one random shard of a facet value."""
+    shard_id = '%s|%s|%d' % (facet, value, random.randint(0, NUM_SHARDS - 1))
+    shard = yield FacetShard.get_by_id_async(shard_id)
+    if shard is None:
+        shard = FacetShard(id=shard_id, facet=facet, value=value)
+    shard.conferences += conferences
+    shard.seatsAvailable += seats
+    yield shard.put_async()
+
+
+@ndb.tasklet
+def changeAsync(old, new):
+    """Apply the difference between two snapshots of a conference,
+    one facet value at a time, all concurrently."""
+    yield [_applyAsync(facet, value, conferences, seats)
+           for (facet, value), (conferences, seats)
+           in _deltas(old, new).items()]
+
+
+def change(old, new):
+    changeAsync(old, new).get_result()
+
+
+def _totals(shards):
+    """Return {facet: [(value, conferences, seats)]}, largest first."""
+    totals = collections.defaultdict(lambda: [0, 0])
+    for shard in shards:
+        total = totals[(shard.facet, shard.value)]
+        total[0] += shard.conferences
+        total[1] += shard.seatsAvailable
+    facets = dict((facet, []) for facet in FACETS)
+    for (facet, value), (conferences, seats) in totals.items():
+        if conferences > 0 and facet in facets:
+            facets[facet].append((value, conferences, seats))
+    for values in facets.values():
+        values.sort(key=lambda v: (-v[1], v[0]))
+    return facets
+
+
+def getFacets():
+    """Return {facet: [(value, conferences, seats)]}, at most
+    FACETS_TTL seconds old."""
+    facets = memcache.get(MEMCACHE_FACETS_KEY)
+    if facets is None:
+        facets = _totals(FacetShard.query())
+        memcache.set(MEMCACHE_FACETS_KEY, facets, time=FACETS_TTL)
+    return facets
+
+
+def _sums(shards):
+    """Return {facet: {value: [conferences, seats]}} summed over
+    shards, in the form count() returns."""
+    sums = {}
+    for shard in shards:
+        total = sums.setdefault(shard.facet, {}).setdefault(shard.value,
+                                                            [0, 0])
+        total[0] += shard.conferences
+        total[1] += shard.seatsAvailable
+    return sums
+
+
+def count(confs, totals=None):
+    """Add the Conferences to totals, {facet: {value: [conferences,
+    seats]}}, and return it."""
+    if totals is None:
+        totals = {}
+    for conf in confs:
+        memberships, seats = snapshot(conf)
+        for facet, value in memberships:
+            total = totals.setdefault(facet, {}).setdefault(value, [0, 0])
+            total[0] += 1
+            total[1] += seats
+    return totals
+
+
+def replace(totals):
+    """Replace the shards with totals from count(), folding each facet
+    value into its first shard and dropping every other shard; for
+    seeding the counters while nothing else changes them."""
+    shards = [FacetShard(id='%s|%s|0' % (facet, value), facet=facet,
+                         value=value, conferences=conferences,
+                         seatsAvailable=seats)
+              for facet, values in totals.items()
+              for value, (conferences, seats) in values.items()]
+    keep = set(shard.key for shard in shards)
+    # put before deleting, so a failure in between leaves old counts
+    # rather than none
+    ndb.put_multi(shards)
+    ndb.delete_multi([key for key in FacetShard.query().iter(keys_only=True)
+                      if key not in keep])
+    memcache.delete(MEMCACHE_FACETS_KEY)
+
+
+@ndb.tasklet
+def _correctAsync(totals, start):
+    """Apply totals minus start, per facet value, to the shards."""
+    futures = []
+    for facet in set(totals) | set(start):
+        counted = totals.get(facet, {})
+        had = start.get(facet, {})
+        for value in set(counted) | set(had):
+            conferences, seats = counted.get(value, [0, 0])
+            conferences_had, seats_had = had.get(value, [0, 0])
+            if (conferences, seats) != (conferences_had, seats_had):
+                futures.append(_applyAsync(facet, value,
+                                           conferences - conferences_had,
+                                           seats - seats_had))
+    yield futures
+
+
+@ndb.transactional()
+def _finish(run_key):
+    """Claim a finished recount, deleting it; return it, or None if it
+    isn't finished or another task already claimed it."""
+    run = run_key.get()
+    if run is None or not run.done:
+        return None
+    run_key.delete()
+    return run
+
+
+@ndb.transactional()
+def _countBatch(run_key, cursor, confs, next_cursor):
+    """Add one batch to a recount and queue the next batch, unless a
+    retry of this batch already has."""
+    run = run_key.get()
+    if run is None or run.done or run.cursor != cursor:
+        return
+    run.totals = count(confs, run.totals or {})
+    if next_cursor:
+        run.cursor = next_cursor
+        taskqueue.add(params={'run': run_key.id(), 'cursor': next_cursor},
+                      url='/tasks/rebuild_facets', transactional=True)
+    else:
+        run.done = True
+    run.put()
+
+
+def rebuild(run_id=None, cursor=None):
+    """Recount one batch of Conferences, queueing the next batch, and
+    after the last correct the shards by the drift found; without
+    run_id, start a new recount."""
+    if run_id is None:
+        run_id = FacetRebuild(totals={},
+                              start=_sums(FacetShard.query())).put().id()
+    run_key = ndb.Key(FacetRebuild, run_id)
+    confs, next_cursor, more = Conference.query().fetch_page(
+        REBUILD_BATCH_SIZE,
+        start_cursor=ndb.Cursor(urlsafe=cursor) if cursor else None)
+    _countBatch(run_key, cursor or '', confs,
+                next_cursor.urlsafe() if more and next_cursor else None)
+    # claimed before correcting: a retry after a failed correction
+    # leaves some drift for the next rebuild rather than applying it
+    # twice
+    run = _finish(run_key)
+    if run is not None:
+        _correctAsync(run.totals or {}, run.start or {}).get_result()
+        memcache.delete(MEMCACHE_FACETS_KEY)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""idpool.py
+
+Udacity conference server-side Python App Engine per-instance id pool
+
+allocate_ids costs one datastore RPC however many ids it reserves, so an
+IdPool reserves BLOCK_SIZE ids at a time and hands them out from memory:
+only one creation in BLOCK_SIZE waits for the allocate RPC.
+
+Pooled ids come from the model's root id space rather than from each
+organiser's, so they are unique whatever parent they are used under, and
+are offset by ID_BASE so they can never collide with the small
+per-organiser ids Conferences were given before the pool existed.  Ids
+left in a pool when its instance shuts down are simply never used.
+
+"""
+
+import threading
+
+from models import Conference
+
+BLOCK_SIZE = 100
+ID_BASE = 1 << 60
+
+
+class IdPool(object):
+    """IdPool -- thread-safe block of pre-allocated datastore ids"""
+
+    def __init__(self, model, block_size=BLOCK_SIZE):
+        self._model = model
+        self._block_size = block_size
+        self._lock = threading.Lock()
+        self._next, self._last = 1, 0
+
+    def next(self):
+        """Return an id no other caller (on any instance) will get."""
+        with self._lock:
+            if self._next > self._last:
+                self._next, self._last = self._model.allocate_ids(
+                    size=self._block_size)
+            id_ = self._next
+            self._next += 1
+        return ID_BASE + id_
+
+
+conferenceIds = IdPool(Conference)
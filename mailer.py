@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+"""mailer.py
+
+Udacity conference server-side Python App Engine outbound mail pipeline
+
+Mail is not sent from the request that asks for it.
+enqueueTransactionalAsync() adds the message to the MAIL_QUEUE pull
+queue as part of the caller's datastore transaction, so it is queued
+exactly when the transaction commits, and the caller then schedules a
+drain.  drain() leases messages MAIL_BATCH_SIZE at a time and sends
+them no faster than settings.MAIL_SEND_RATE per second.  A message that
+fails to send is queued again with its failure count in the payload,
+leasable after an exponential backoff, until it has failed MAX_ATTEMPTS
+times.  The task's own retry_count isn't used: it also counts leases
+handed back unsent at the drain's deadline or while another drain was
+sending the message.
+
+Transactional tasks can't be named, so the queue doesn't dedupe
+messages; instead a memcache marker per dedupe key, set once a message
+is sent, keeps a later lease of its task from sending it again.
+
+Everything goes through mail.send_mail and the taskqueue API, so the
+pipeline runs unchanged against the testbed mail and taskqueue stubs
+(with queue.yaml loaded for the pull queue).
+
+"""
+
+import hashlib
+import json
+import logging
+import time
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import settings
+
+MAIL_QUEUE = 'mail-outbox'
+MAIL_BATCH_SIZE = 50
+LEASE_SECONDS = 60
+DRAIN_SECONDS = 45      # time budget of one drain task
+DRAIN_DELAY = 5         # seconds enqueues are coalesced into one drain
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 30    # doubled for every failed attempt
+MEMCACHE_SENT_KEY = "MAIL_SENT_%s"
+SENT_TTL = 24 * 60 * 60
+MEMCACHE_SENDING_KEY = "MAIL_SENDING_%s"
+SENDING_TTL = 30        # seconds a send may take before it is retried
+
+
+def _markerName(dedupe_key):
+    """Return a short, stable memcache key suffix for a dedupe key."""
+    return 'mail-%s' % hashlib.sha1(dedupe_key.encode('utf-8')).hexdigest()
+
+
+def _sender():
+    return 'noreply@%s.appspotmail.com' % app_identity.get_application_id()
+
+
+@ndb.tasklet
+def scheduleDrainAsync(countdown=DRAIN_DELAY):
+    """Queue one named drain task per DRAIN_DELAY window, so a burst
+    of enqueues is sent by a single drain."""
+    window = int(time.time() + countdown) // DRAIN_DELAY
+    try:
+        yield taskqueue.Queue().add_async(taskqueue.Task(
+            name='mail-drain-%d' % window, countdown=countdown,
+            url='/tasks/send_mail'))
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        pass
+
+
+def scheduleDrain(countdown=DRAIN_DELAY):
+    scheduleDrainAsync(countdown).get_result()
+
+
+def _payload(to, subject, body, dedupe_key, attempts=0):
+    return json.dumps({'to': to, 'subject': subject, 'body': body,
+                       'key': dedupe_key, 'attempts': attempts})
+
+
+@ndb.tasklet
+def enqueueTransactionalAsync(to, subject, body, dedupe_key):
+    """Queue a message as part of the current datastore transaction; call
+    scheduleDrain once the transaction commits.  A tasklet, so its
+    Future can be yielded alongside other Futures.
+
+    Transactional tasks cannot be named, but the transaction adds the
+    task exactly once; the sent marker still dedupes the send.
+    """
+    yield taskqueue.Queue(MAIL_QUEUE).add_async(
+        taskqueue.Task(payload=_payload(to, subject, body, dedupe_key),
+                       method='PULL'),
+        transactional=True)
+
+
+def _send(message):
+    """Send one message unless it is already marked as sent; return
+    False if another drain is sending it right now."""
+    name = _markerName(message['key'])
+    sent_key = MEMCACHE_SENT_KEY % name
+    sending_key = MEMCACHE_SENDING_KEY % name
+    # a lease can run out while a message is being sent; the short
+    # lived claim keeps a second drain from sending it at the same
+    # time, and expires if its holder dies mid-send
+    if not memcache.add(sending_key, 1, time=SENDING_TTL):
+        return False
+    try:
+        # ... or after it was sent but before its task was deleted; the
+        # sent marker keeps the next lease from resending it
+        if memcache.get(sent_key):
+            return True
+        mail.send_mail(_sender(), message['to'], message['subject'],
+                       message['body'])
+        # only marked once sent, so a drain that dies mid-send leaves
+        # the message to be sent again rather than lost
+        memcache.set(sent_key, 1, time=SENT_TTL)
+        return True
+    finally:
+        memcache.delete(sending_key)
+
+
+def drain(deadline=None):
+    """Send queued mail, batch by batch, at settings.MAIL_SEND_RATE
+    messages per second until the queue is empty or DRAIN_SECONDS have
+    passed; return the number of messages sent."""
+    queue = taskqueue.Queue(MAIL_QUEUE)
+    deadline = deadline or time.time() + DRAIN_SECONDS
+    interval = 1.0 / settings.MAIL_SEND_RATE
+    next_send = time.time()
+    sent = 0
+    retry_in = None
+
+    while time.time() < deadline:
+        tasks = queue.lease_tasks(LEASE_SECONDS, MAIL_BATCH_SIZE)
+        if not tasks:
+            if retry_in is not None:
+                # come back for messages that are backing off
+                scheduleDrain(retry_in)
+            return sent
+        done = []
+        retries = []
+        for i, task in enumerate(tasks):
+            if time.time() >= deadline:
+                # out of time; hand the rest back for the next drain
+                for rest in tasks[i:]:
+                    queue.modify_task_lease(rest, 0)
+                break
+            time.sleep(max(next_send - time.time(), 0))
+            next_send = max(next_send, time.time()) + interval
+            message = json.loads(task.payload)
+            try:
+                if not _send(message):
+                    # another drain is sending it; look again once its
+                    # claim has expired, in case that drain died
+                    queue.modify_task_lease(task, SENDING_TTL)
+                    continue
+            except Exception:
+                attempts = message.get('attempts', 0) + 1
+                if attempts >= MAX_ATTEMPTS:
+                    logging.exception('giving up on mail to %s after %d '
+                                      'attempts', message['to'], attempts)
+                else:
+                    logging.warning('mail to %s failed (attempt %d)',
+                                    message['to'], attempts,
+                                    exc_info=True)
+                    backoff = BACKOFF_SECONDS * 2 ** (attempts - 1)
+                    retries.append(taskqueue.Task(
+                        payload=_payload(message['to'], message['subject'],
+                                         message['body'], message['key'],
+                                         attempts),
+                        method='PULL', countdown=backoff))
+                    retry_in = min(retry_in or backoff, backoff)
+                done.append(task)
+                continue
+            done.append(task)
+            sent += 1
+        # requeue before deleting, so a failure in between can only
+        # duplicate a message, which the sent marker catches
+        if retries:
+            queue.add(retries)
+        if done:
+            queue.delete_tasks(done)
+
+    # more may be waiting; let another drain pick it up
+    scheduleDrain()
+    return sent
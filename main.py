@@ -12,10 +12,20 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.ext import ndb
 from conference import ConferenceApi
+import cache
+import confsearch
+import facets
+import mailer
+import profiler
+import rpcstats
+import seats
 
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
@@ -28,13 +38,98 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
 class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
         """Sets Featured Speaker in Memcache."""
-        ConferenceApi._speakerAnnouncement(self.request.get('c_key'),
-                                           self.request.get('speaker'))
+        ConferenceApi._speakerAnnouncement(self.request.get('c_key'))
+
+
+class RebuildSpeakersHandler(webapp2.RequestHandler):
+    def post(self):
+        """Rebuild a Conference's Speaker index from its Sessions, or,
+        without c_key, every Conference's, one batch per task."""
+        c_key = self.request.get('c_key')
+        cursor = self.request.get('cursor')
+        if c_key:
+            ConferenceApi._rebuildSpeakers(ndb.Key(urlsafe=c_key))
+        else:
+            ConferenceApi._backfillSpeakers(
+                ndb.Cursor(urlsafe=cursor) if cursor else None)
+
+
+class BackfillRegistrationsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Write Registrations for Profiles that predate them."""
+        cursor = self.request.get('cursor')
+        ConferenceApi._backfillRegistrations(
+            ndb.Cursor(urlsafe=cursor) if cursor else None)
+
+
+class IndexConferenceHandler(webapp2.RequestHandler):
+    def post(self):
+        """(Re)write Conference search documents."""
+        c_key = self.request.get('c_key')
+        cursor = self.request.get('cursor')
+        confsearch.reindex(
+            ndb.Key(urlsafe=c_key) if c_key else None,
+            ndb.Cursor(urlsafe=cursor) if cursor else None)
+
+
+class RebuildFacetsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start recounting the conference facets from scratch."""
+        facets.rebuild()
+        self.response.set_status(204)
+
+    def post(self):
+        """Recount the next batch of conferences into the facets."""
+        facets.rebuild(int(self.request.get('run')),
+                       self.request.get('cursor') or None)
+
+
+class RpcStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return this instance's per-request RPC statistics and cache
+        hit rates as JSON; ?reset=1 starts them over."""
+        stats = rpcstats.snapshot()
+        stats['cache'] = cache.snapshot()
+        if self.request.get('reset'):
+            rpcstats.reset()
+            cache.reset()
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(stats, indent=2, sort_keys=True))
+
+
+class ProfileHandler(webapp2.RequestHandler):
+    def get(self):
+        """Download this instance's profile: the top functions, or with
+        ?format=collapsed every stack for flame graph tools; ?reset=1
+        starts it over."""
+        if self.request.get('format') == 'collapsed':
+            body, filename = profiler.collapsed(), 'profile.collapsed'
+        else:
+            body = profiler.top(int(self.request.get('limit') or 50))
+            filename = 'profile.txt'
+        if self.request.get('reset'):
+            profiler.reset()
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.headers['Content-Disposition'] = (
+            'attachment; filename=%s' % filename)
+        self.response.write(body)
+
+
+class SendMailHandler(webapp2.RequestHandler):
+    def post(self):
+        """Send queued mail in rate-limited batches."""
+        mailer.drain()
+
+    def get(self):
+        """Cron backstop for mail whose drain task was never queued."""
+        mailer.drain()
+        self.response.set_status(204)
 
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
+        """Send email confirming Conference creation (tasks queued
+        before mail went through mailer)."""
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -45,8 +140,24 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
                 'conferenceInfo')
         )
 
-app = webapp2.WSGIApplication([
+class ReconcileSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Fold sharded seat counts back into the Conference."""
+        seats.reconcile(ndb.Key(urlsafe=self.request.get('c_key')))
+
+
+app = rpcstats.middleware(profiler.middleware(webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
     ('/tasks/set_featured_speaker', SetFeaturedSpeakerHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
-], debug=True)
+    ('/tasks/send_mail', SendMailHandler),
+    ('/crons/send_mail', SendMailHandler),
+    ('/crons/rebuild_facets', RebuildFacetsHandler),
+    ('/tasks/rebuild_facets', RebuildFacetsHandler),
+    ('/tasks/reconcile_seats', ReconcileSeatsHandler),
+    ('/tasks/rebuild_speakers', RebuildSpeakersHandler),
+    ('/tasks/backfill_registrations', BackfillRegistrationsHandler),
+    ('/tasks/index_conference', IndexConferenceHandler),
+    ('/admin/rpcstats', RpcStatsHandler),
+    ('/admin/profile', ProfileHandler),
+], debug=True)))
@@ -29,7 +29,30 @@ class Profile(ndb.Model):
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    # legacy wishlist storage (websafe strings, then keys); moved into
+    # WishlistEntry children the next time the wishlist is used
     sessionsInWishlist = ndb.StringProperty(repeated=True)
+    wishlist = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+    wishlistVersion = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class WishlistEntry(ndb.Model):
+    """WishlistEntry -- a Session in the wishlist of its parent Profile,
+    keyed by the Session's websafe key, with the Session fields the
+    wishlist can be filtered on copied in"""
+    sessionKey = ndb.KeyProperty(kind='Session', required=True,
+                                 indexed=False)
+    speaker = ndb.StringProperty()
+    date = ndb.DateProperty()
+    startTime = ndb.TimeProperty()
+    typeOfSession = ndb.StringProperty(repeated=True)
+
+
+class Registration(ndb.Model):
+    """Registration -- a Profile's (its parent) registration for a
+    Conference, keyed by the Conference's websafe key"""
+    conference = ndb.KeyProperty(kind='Conference', required=True)
+    registeredAt = ndb.DateTimeProperty(auto_now_add=True, indexed=False)
 
 
 class ProfileMiniForm(messages.Message):
@@ -44,7 +67,43 @@ class ProfileForm(messages.Message):
     mainEmail = messages.StringField(2)
     teeShirtSize = messages.EnumField('TeeShirtSize', 3)
     conferenceKeysToAttend = messages.StringField(4, repeated=True)
-    sessionsInWishlist = messages.StringField(5, repeated=True)
+    # 5 was sessionsInWishlist; the wishlist comes from
+    # getSessionsInWishlist only
+
+
+class WishlistDeltaForm(messages.Message):
+    """WishlistDeltaForm -- outbound wishlist change message"""
+    added = messages.StringField(1, repeated=True)
+    removed = messages.StringField(2, repeated=True)
+    version = messages.IntegerField(3)
+
+
+class AttendeeForm(messages.Message):
+    """AttendeeForm -- Conference attendee outbound form message"""
+    displayName = messages.StringField(1)
+    mainEmail = messages.StringField(2)
+    registeredAt = messages.StringField(3)  # DateTimeField()
+
+
+class AttendeeForms(messages.Message):
+    """AttendeeForms -- multiple attendee outbound form message"""
+    items = messages.MessageField(AttendeeForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+
+class FacetValueForm(messages.Message):
+    """FacetValueForm -- one facet value's counts outbound form message"""
+    value = messages.StringField(1)
+    conferences = messages.IntegerField(2)
+    seatsAvailable = messages.IntegerField(3)
+
+
+class ConferenceFacetsForm(messages.Message):
+    """ConferenceFacetsForm -- conference counts per city, topic and
+    month outbound form message"""
+    cities = messages.MessageField(FacetValueForm, 1, repeated=True)
+    topics = messages.MessageField(FacetValueForm, 2, repeated=True)
+    months = messages.MessageField(FacetValueForm, 3, repeated=True)
 
 
 class StringMessage(messages.Message):
@@ -60,8 +119,8 @@ class BooleanMessage(messages.Message):
 class Conference(ndb.Model):
     """Conference -- Conference object"""
     name = ndb.StringProperty(required=True)
-    description = ndb.StringProperty()
-    organizerUserId = ndb.StringProperty()
+    description = ndb.StringProperty(indexed=False)
+    organizerUserId = ndb.StringProperty(indexed=False)
     topics = ndb.StringProperty(repeated=True)
     city = ndb.StringProperty()
     startDate = ndb.DateProperty()
@@ -72,6 +131,30 @@ class Conference(ndb.Model):
     seatsAvailable = ndb.IntegerProperty()
 
 
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a Conference's available seats"""
+    seatsAvailable = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class FacetShard(ndb.Model):
+    """FacetShard -- one slice of a facet value's conference count and
+    remaining seat total"""
+    facet = ndb.StringProperty(indexed=False)
+    value = ndb.StringProperty(indexed=False)
+    conferences = ndb.IntegerProperty(default=0, indexed=False)
+    seatsAvailable = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class FacetRebuild(ndb.Model):
+    """FacetRebuild -- a facet recount in progress: the shard sums when
+    it started, the totals of the Conferences counted so far and the
+    cursor of the next batch"""
+    start = ndb.JsonProperty()
+    totals = ndb.JsonProperty()
+    cursor = ndb.StringProperty(indexed=False, default='')
+    done = ndb.BooleanProperty(indexed=False, default=False)
+
+
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
     name = messages.StringField(1)
@@ -88,9 +171,22 @@ class ConferenceForm(messages.Message):
     organizerDisplayName = messages.StringField(12)
 
 
+class ConferenceSummaryForm(messages.Message):
+    """ConferenceSummaryForm -- Conference outbound summary message"""
+    name = messages.StringField(1)
+    city = messages.StringField(2)
+    startDate = messages.StringField(3)  # DateTimeField()
+    endDate = messages.StringField(4)  # DateTimeField()
+    seatsAvailable = messages.IntegerField(5)
+    websafeKey = messages.StringField(6)
+
+
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    summaries = messages.MessageField(ConferenceSummaryForm, 3,
+                                      repeated=True)
 
 
 class Session(ndb.Model):
@@ -105,6 +201,15 @@ class Session(ndb.Model):
     startTime = ndb.TimeProperty()
 
 
+class Speaker(ndb.Model):
+    """Speaker -- a speaker's sessions within one Conference (its parent)"""
+    name = ndb.StringProperty(required=True)
+    sessionKeys = ndb.KeyProperty(kind='Session', repeated=True,
+                                  indexed=False)
+    sessionNames = ndb.StringProperty(repeated=True, indexed=False)
+    numSessions = ndb.ComputedProperty(lambda self: len(self.sessionKeys))
+
+
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
     name = messages.StringField(1)
@@ -118,9 +223,20 @@ class SessionForm(messages.Message):
     websafeKey = messages.StringField(9)
 
 
+class SessionSummaryForm(messages.Message):
+    """SessionSummaryForm -- Session outbound summary message"""
+    name = messages.StringField(1)
+    speaker = messages.StringField(2)
+    date = messages.StringField(3)  # DateTimeField()
+    startTime = messages.StringField(4)
+    websafeKey = messages.StringField(5)
+
+
 class SessionForms(messages.Message):
     """SessionForms -- multiple Sessions outbound form message"""
     items = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    summaries = messages.MessageField(SessionSummaryForm, 3, repeated=True)
 
 
 class TeeShirtSize(messages.Enum):
@@ -142,6 +258,12 @@ class TeeShirtSize(messages.Enum):
     XXXL_W = 15
 
 
+class ListView(messages.Enum):
+    """ListView -- full items or summaries from list endpoints"""
+    FULL = 1
+    SUMMARY = 2
+
+
 class ConferenceQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
     field = messages.StringField(1)
@@ -153,3 +275,33 @@ class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm
     inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    view = messages.EnumField('ListView', 4, default='FULL')
+
+
+class ConferenceSearchForm(messages.Message):
+    """ConferenceSearchForm -- Conference full-text search inbound form
+    message"""
+    query = messages.StringField(1)
+    fields = messages.StringField(2, repeated=True)
+    pageSize = messages.IntegerField(3)
+    pageToken = messages.StringField(4)
+    view = messages.EnumField('ListView', 5, default='FULL')
+
+
+class SessionQueryForm(messages.Message):
+    """SessionQueryForm -- Session query inbound form message"""
+    field = messages.StringField(1)
+    operator = messages.StringField(2)
+    value = messages.StringField(3)
+
+
+class SessionQueryForms(messages.Message):
+    """SessionQueryForms -- multiple SessionQueryForm
+    inbound form message"""
+    filters = messages.MessageField(SessionQueryForm, 1, repeated=True)
+    websafeConferenceKey = messages.StringField(2)
+    pageSize = messages.IntegerField(3)
+    pageToken = messages.StringField(4)
+    view = messages.EnumField('ListView', 5, default='FULL')
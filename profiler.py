@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""profiler.py
+
+Udacity conference server-side Python App Engine opt-in sampling
+profiler
+
+middleware() wraps a WSGI application (the endpoints server and the
+webapp2 app).  A request is profiled when it is one of the
+settings.PROFILE_SAMPLE_RATE fraction picked at random, or, with
+settings.PROFILE_SLOW_MS set, when it turns out to take that long: a
+Sampler thread records the request thread's stack every SAMPLE_INTERVAL
+seconds, and the samples of profiled requests are added to per-instance
+stack counts.  With both settings off, which is the default, a request
+costs one settings check.
+
+top() turns the stack counts into the functions with the most samples
+(self and cumulative), and collapsed() into one line per stack for flame
+graph tools; main.py serves both for download at the admin-only
+/admin/profile.
+
+"""
+
+import collections
+import os
+import random
+import sys
+import threading
+import time
+
+import rpcstats
+import settings
+
+SAMPLE_INTERVAL = 0.005     # seconds
+MAX_DEPTH = 50
+MAX_STACKS = 20000          # distinct stacks kept per instance
+OTHER = ('(other stacks)',)
+
+_lock = threading.Lock()
+_stacks = collections.Counter()
+_requests = collections.Counter()
+_since = time.time()
+
+
+class Sampler(threading.Thread):
+    """Sampler -- samples one thread's stack until stopped"""
+
+    def __init__(self, target_ident):
+        threading.Thread.__init__(self, name='profiler-sampler')
+        self.daemon = True
+        self.target_ident = target_ident
+        self.samples = collections.Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.target_ident)
+            if frame is not None:
+                self.samples[_stack(frame)] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+def _function(code):
+    return '%s:%d(%s)' % (os.path.basename(code.co_filename),
+                          code.co_firstlineno, code.co_name)
+
+
+def _stack(frame):
+    """Return a frame's stack as functions, outermost first."""
+    stack = []
+    while frame is not None and len(stack) < MAX_DEPTH:
+        stack.append(_function(frame.f_code))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+def _record(name, samples):
+    with _lock:
+        _requests[name] += 1
+        for stack, count in samples.items():
+            if stack not in _stacks and len(_stacks) >= MAX_STACKS:
+                stack = OTHER
+            _stacks[stack] += count
+
+
+def middleware(app):
+    """Return app with opted-in requests profiled."""
+    def profiled(environ, start_response):
+        rate = settings.PROFILE_SAMPLE_RATE
+        slow_ms = settings.PROFILE_SLOW_MS
+        sampled = bool(rate) and random.random() < rate
+        if not sampled and slow_ms is None:
+            return app(environ, start_response)
+
+        sampler = Sampler(threading.current_thread().ident)
+        sampler.start()
+        start = time.time()
+        try:
+            return app(environ, start_response)
+        finally:
+            # the sampler must not outlive the request
+            sampler.stop()
+            if sampled or (time.time() - start) * 1000 >= slow_ms:
+                _record(rpcstats.requestName(environ), sampler.samples)
+    return profiled
+
+
+def top(limit=50):
+    """Return a text table of the functions with the most samples."""
+    with _lock:
+        stacks = dict(_stacks)
+        requests = dict(_requests)
+    own = collections.Counter()
+    cumulative = collections.Counter()
+    for stack, count in stacks.items():
+        own[stack[-1]] += count
+        for function in set(stack):
+            cumulative[function] += count
+    total = sum(stacks.values()) or 1
+
+    lines = ['# %d samples every %gms from %d requests since %s' % (
+                 sum(stacks.values()), SAMPLE_INTERVAL * 1000,
+                 sum(requests.values()),
+                 time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(_since))),
+             '# ' + ', '.join('%s: %d' % item
+                              for item in sorted(requests.items())),
+             '%8s %8s %8s %8s  %s' % ('self', 'self%', 'cum', 'cum%',
+                                      'function')]
+    for function, count in own.most_common(limit):
+        lines.append('%8d %7.1f%% %8d %7.1f%%  %s' % (
+            count, 100.0 * count / total, cumulative[function],
+            100.0 * cumulative[function] / total, function))
+    return '\n'.join(lines) + '\n'
+
+
+def collapsed():
+    """Return the stacks in collapsed form ("a;b;c count" per line)."""
+    with _lock:
+        stacks = dict(_stacks)
+    return ''.join('%s %d\n' % (';'.join(stack), count)
+                   for stack, count in sorted(stacks.items()))
+
+
+def reset():
+    """Drop this instance's samples."""
+    global _since
+    with _lock:
+        _stacks.clear()
+        _requests.clear()
+        _since = time.time()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""queryfilters.py
+
+Udacity conference server-side Python App Engine query filters
+
+What the conference and session query planners (confquery.py and
+sessionquery.py) share: the filter operators the query endpoints accept,
+and matches(), which applies the filters a plan leaves out of the
+datastore query (its residual) to entities in memory.
+
+"""
+
+OPERATORS = {'EQ':   '=',
+             'GT':   '>',
+             'GTEQ': '>=',
+             'LT':   '<',
+             'LTEQ': '<=',
+             'NE':   '!='}
+
+COMPARE = {'=':  lambda a, b: a == b,
+           '>':  lambda a, b: a > b,
+           '>=': lambda a, b: a >= b,
+           '<':  lambda a, b: a < b,
+           '<=': lambda a, b: a <= b,
+           '!=': lambda a, b: a != b}
+
+
+def matches(entity, residual, repeated=(), none_of=False):
+    """Return True if an entity passes every residual filter.  Like the
+    datastore, a filter on one of the repeated properties matches if
+    any one value does, and a missing value never matches; with
+    none_of, != on a repeated property means "is none of" instead."""
+    for filtr in residual:
+        value = getattr(entity, filtr['field'])
+        operator = filtr['operator']
+        compare = COMPARE[operator]
+        if filtr['field'] in repeated:
+            if operator == '!=' and none_of:
+                ok = filtr['value'] not in value
+            else:
+                ok = any(compare(v, filtr['value']) for v in value)
+        else:
+            ok = value is not None and compare(value, filtr['value'])
+        if not ok:
+            return False
+    return True
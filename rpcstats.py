@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+"""rpcstats.py
+
+Udacity conference server-side Python App Engine per-request RPC
+accounting
+
+middleware() wraps a WSGI application (the endpoints server and the
+webapp2 app), so every ConferenceApi method and every handler is
+accounted for.  apiproxy hooks, installed once per instance, record each
+datastore, memcache, taskqueue, urlfetch, ... call a request makes: its
+count, request plus response bytes, and wall time from issue to
+completion, so overlapping async RPCs each show their own latency.
+When the request ends:
+
+- its totals are added to the per-instance aggregates for its name (the
+  endpoints method, or the handler's method and path);
+- if it took SLOW_REQUEST_MS or more, its summary goes into a ring
+  buffer of the last SLOW_BUFFER_SIZE slow requests;
+- with settings.RPC_STATS_DEBUG on, the summary is logged and sent back
+  in an X-RPC-Stats response header.
+
+snapshot() returns the aggregates and slow requests; main.py serves
+them at the admin-only /admin/rpcstats.
+
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+
+import settings
+
+SLOW_REQUEST_MS = 500
+SLOW_BUFFER_SIZE = 50
+SPI_PREFIX = '/_ah/spi/'
+HEADER = 'X-RPC-Stats'
+
+_local = threading.local()
+_lock = threading.Lock()
+_hooks_lock = threading.Lock()
+_hooked = []
+_aggregates = {}
+_slow = collections.deque(maxlen=SLOW_BUFFER_SIZE)
+_since = time.time()
+
+
+class RequestStats(object):
+    """RequestStats -- the RPCs one request made"""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = time.time()
+        # 'service.Call' -> [count, bytes, ms]
+        self.calls = collections.defaultdict(lambda: [0, 0, 0.0])
+        self.pending = {}
+
+    def elapsed(self):
+        return (time.time() - self.start) * 1000
+
+    def summary(self):
+        return {'name': self.name,
+                'at': self.start,
+                'ms': round(self.elapsed(), 1),
+                'calls': dict((call, {'count': count, 'bytes': size,
+                                      'ms': round(ms, 1)})
+                              for call, (count, size, ms)
+                              in self.calls.items())}
+
+    def header(self):
+        """Compact one-line summary, slowest calls first."""
+        calls = sorted(self.calls.items(), key=lambda item: -item[1][2])
+        return '%.1fms; %s' % (self.elapsed(), ', '.join(
+            '%s=%dx/%dB/%.1fms' % (call, count, size, ms)
+            for call, (count, size, ms) in calls))
+
+
+def _size(pb):
+    try:
+        return pb.ByteSize()
+    except Exception:
+        return 0
+
+
+def _preCall(service, call, request, response, rpc=None):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.pending[id(rpc)] = time.time()
+
+
+def _postCall(service, call, request, response, rpc=None, error=None):
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        return
+    started = stats.pending.pop(id(rpc), None)
+    entry = stats.calls['%s.%s' % (service, call)]
+    entry[0] += 1
+    entry[1] += _size(request) + _size(response)
+    if started is not None:
+        entry[2] += (time.time() - started) * 1000
+
+
+def _installHooks():
+    """Add the accounting hooks to the apiproxy, once per instance."""
+    if _hooked:
+        return
+    with _hooks_lock:
+        if not _hooked:
+            apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+                'rpcstats', _preCall)
+            apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+                'rpcstats', _postCall)
+            _hooked.append(True)
+
+
+def requestName(environ):
+    """Name a request by endpoints method, or handler method and path."""
+    path = environ.get('PATH_INFO', '')
+    if path.startswith(SPI_PREFIX):
+        return path[len(SPI_PREFIX):]
+    return '%s %s' % (environ.get('REQUEST_METHOD', 'GET'), path)
+
+
+def _record(stats):
+    """Fold a finished request into the aggregates and slow buffer."""
+    ms = stats.elapsed()
+    with _lock:
+        agg = _aggregates.setdefault(stats.name, {
+            'requests': 0, 'ms': 0.0, 'max_ms': 0.0,
+            'calls': collections.defaultdict(lambda: [0, 0, 0.0])})
+        agg['requests'] += 1
+        agg['ms'] += ms
+        agg['max_ms'] = max(agg['max_ms'], ms)
+        for call, values in stats.calls.items():
+            total = agg['calls'][call]
+            for i, value in enumerate(values):
+                total[i] += value
+        if ms >= SLOW_REQUEST_MS:
+            _slow.append(stats.summary())
+    if settings.RPC_STATS_DEBUG:
+        logging.info('rpcstats %s: %s', stats.name, stats.header())
+
+
+def middleware(app):
+    """Return app with every request's RPCs accounted for."""
+    def accounted(environ, start_response):
+        _installHooks()
+        stats = _local.stats = RequestStats(requestName(environ))
+
+        def start(status, headers, exc_info=None):
+            # both apps buffer their responses, so every RPC the
+            # request made has completed by now
+            if settings.RPC_STATS_DEBUG:
+                headers = list(headers) + [(HEADER, stats.header())]
+            return start_response(status, headers, exc_info)
+
+        try:
+            return app(environ, start)
+        finally:
+            _local.stats = None
+            _record(stats)
+    return accounted
+
+
+def snapshot():
+    """Return this instance's aggregates and slow requests."""
+    with _lock:
+        endpoints = dict(
+            (name, {'requests': agg['requests'],
+                    'mean_ms': round(agg['ms'] / agg['requests'], 1),
+                    'max_ms': round(agg['max_ms'], 1),
+                    'calls': dict(
+                        (call, {'count': count, 'bytes': size,
+                                'ms': round(ms, 1),
+                                'per_request': round(
+                                    float(count) / agg['requests'], 2)})
+                        for call, (count, size, ms)
+                        in agg['calls'].items())})
+            for name, agg in _aggregates.items())
+        slow = list(_slow)
+    return {'instance': os.environ.get('INSTANCE_ID'),
+            'since': _since,
+            'endpoints': endpoints,
+            'slow': slow}
+
+
+def reset():
+    """Drop this instance's aggregates and slow requests."""
+    global _since
+    with _lock:
+        _aggregates.clear()
+        _slow.clear()
+        _since = time.time()
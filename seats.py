@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+"""seats.py
+
+Udacity conference server-side Python App Engine sharded seat counter
+
+A Conference's capacity is spread over NUM_SHARDS root SeatShard
+entities, so concurrent registrations land in different entity groups
+instead of all fighting over the Conference.  Conference.seatsAvailable
+becomes a lazily reconciled view: registrations queue a named reconcile
+task per conference and time window, which sums the shards back into it.
+An owner's update to seatsAvailable is added to the shards as a change
+by addSeats(), on top of whatever registrations have done to them.
+
+"""
+
+import random
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import SeatShard
+import cache
+import facets
+import soldout
+
+NUM_SHARDS = 20
+RECONCILE_DELAY = 10    # seconds between seatsAvailable reconciles
+
+
+def _shardKeys(c_key):
+    """Return the (deterministic) SeatShard keys for a conference."""
+    base = c_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s-%d' % (base, i))
+            for i in range(NUM_SHARDS)]
+
+
+def _split(seats):
+    """Split seats as evenly as possible across NUM_SHARDS."""
+    share, extra = divmod(max(seats or 0, 0), NUM_SHARDS)
+    return [share + (1 if i < extra else 0) for i in range(NUM_SHARDS)]
+
+
+def newShards(c_key, seats):
+    """Return (unsaved) shards holding seats for a conference."""
+    return [SeatShard(key=key, seatsAvailable=n)
+            for key, n in zip(_shardKeys(c_key), _split(seats))]
+
+
+def getShards(conf):
+    """Return a conference's shards, lazily splitting its stored
+    seatsAvailable over new shards if it predates sharding."""
+    keys = _shardKeys(conf.key)
+    shards = ndb.get_multi(keys)
+    if None in shards:
+        # get_or_insert is transactional per shard and the split is
+        # deterministic, so racing requests agree on the result
+        shards = [shard or SeatShard.get_or_insert(key.id(),
+                                                   seatsAvailable=n)
+                  for shard, key, n in zip(shards, keys,
+                                           _split(conf.seatsAvailable))]
+    return shards
+
+
+@ndb.transactional()
+def _addToShard(shard_key, seats):
+    """Add seats to one shard, or take up to -seats away without going
+    below zero; return the change made."""
+    shard = shard_key.get()
+    change = max(seats, -shard.seatsAvailable)
+    if change:
+        shard.seatsAvailable += change
+        shard.put()
+    return change
+
+
+def addSeats(conf, seats):
+    """Add seats to a conference's shards (or take -seats away), one
+    shard per transaction, on top of whatever registrations have done
+    to them; return the change made, which stops short of a negative
+    seats once every shard is empty."""
+    keys = _shardKeys(conf.key)
+    shards = ndb.get_multi(keys)
+    if None in shards:
+        # not (fully) sharded yet: the missing shards are split from
+        # the stored seatsAvailable, which already includes the change
+        getShards(conf)
+        return seats
+    if seats >= 0:
+        for key, n in zip(keys, _split(seats)):
+            if n:
+                _addToShard(key, n)
+        return seats
+    # take seats from the fullest shards first
+    change = 0
+    for shard in sorted(shards, key=lambda shard: -shard.seatsAvailable):
+        if change == seats:
+            break
+        change += _addToShard(shard.key, seats - change)
+    return change
+
+
+def reserveOrder(shards):
+    """Return keys of shards that appeared to have seats, shuffled so
+    concurrent registrations spread out over them."""
+    keys = [shard.key for shard in shards if shard.seatsAvailable > 0]
+    random.shuffle(keys)
+    return keys
+
+
+def releaseOrder(shards):
+    """Return the key of a random shard to give a seat back to."""
+    return [random.choice(shards).key]
+
+
+def scheduleReconcile(c_key):
+    """Queue a seatsAvailable reconcile for a conference; tasks are
+    named per conference and window so a burst queues only one."""
+    window = int(time.time()) // RECONCILE_DELAY
+    try:
+        taskqueue.add(name='seats-%s-%d' % (c_key.urlsafe(), window),
+                      params={'c_key': c_key.urlsafe()},
+                      url='/tasks/reconcile_seats',
+                      countdown=RECONCILE_DELAY)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def reconcile(c_key):
+    """Fold the shard totals back into Conference.seatsAvailable."""
+    shards = ndb.get_multi(_shardKeys(c_key))
+    if None in shards:
+        # never (fully) sharded; the stored value is still authoritative
+        return
+    seats = sum(shard.seatsAvailable for shard in shards)
+    conf = _setSeatsAvailable(c_key, seats)
+    if conf:
+        soldout.update(conf, seats)
+
+
+@ndb.transactional()
+def _setSeatsAvailable(c_key, seats):
+    conf = c_key.get()
+    if conf and conf.seatsAvailable != seats:
+        before = facets.snapshot(conf)
+        conf.seatsAvailable = seats
+        conf.put()
+        cache.invalidateConference(c_key)
+        # the remaining seat totals follow the reconciled count, so a
+        # burst of registrations is one facet change
+        after = facets.snapshot(conf)
+        ndb.get_context().call_on_commit(
+            lambda: facets.change(before, after))
+    return conf
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""serializers.py
+
+Udacity conference server-side Python App Engine entity-to-message
+copy plans
+
+Each CopyPlan is built once at import time for a (model, message) pair:
+the fields the two share and the conversion each one needs are decided
+up front, so copying a row is a straight walk over a short list instead
+of reflecting over message.all_fields() for every entity.
+
+"""
+
+from models import Conference
+from models import ConferenceForm
+from models import ConferenceSummaryForm
+from models import Profile
+from models import ProfileForm
+from models import Session
+from models import SessionForm
+from models import SessionSummaryForm
+from models import TeeShirtSize
+
+
+class CopyPlan(object):
+    """CopyPlan -- precompiled copy of ndb entity fields to a message"""
+
+    def __init__(self, model, message, converters=None, key_field=None):
+        converters = converters or {}
+        self.message = message
+        self.key_field = key_field
+        # (field name, converter or None) for every field the message
+        # shares with the model, in message field order
+        self.steps = tuple((field.name, converters.get(field.name))
+                           for field in message.all_fields()
+                           if hasattr(model, field.name))
+        # none of our forms have required fields today; only pay for
+        # check_initialized() if one ever does
+        self.check = any(field.required for field in message.all_fields())
+
+    def copy(self, entity, fixed=None):
+        """Copy entity into a new message instance; values in fixed are
+           used instead of the entity's (e.g. for unprojected fields)."""
+        msg = self.message()
+        for name, convert in self.steps:
+            if fixed and name in fixed:
+                value = fixed[name]
+            else:
+                value = getattr(entity, name)
+            if convert is not None:
+                value = convert(value)
+            setattr(msg, name, value)
+        if self.key_field:
+            setattr(msg, self.key_field, entity.key.urlsafe())
+        if self.check:
+            msg.check_initialized()
+        return msg
+
+
+def _teeShirtSize(value):
+    """Convert a stored t-shirt string to its TeeShirtSize enum."""
+    return getattr(TeeShirtSize, value)
+
+
+# convert Date/Time to strings; everything else is copied as is
+CONFERENCE_PLAN = CopyPlan(Conference, ConferenceForm,
+                           {'startDate': str, 'endDate': str},
+                           key_field='websafeKey')
+
+SESSION_PLAN = CopyPlan(Session, SessionForm,
+                        {'date': str, 'startTime': str},
+                        key_field='websafeKey')
+
+CONFERENCE_SUMMARY_PLAN = CopyPlan(Conference, ConferenceSummaryForm,
+                                   {'startDate': str, 'endDate': str},
+                                   key_field='websafeKey')
+
+SESSION_SUMMARY_PLAN = CopyPlan(Session, SessionSummaryForm,
+                                {'date': str, 'startTime': str},
+                                key_field='websafeKey')
+
+PROFILE_PLAN = CopyPlan(Profile, ProfileForm,
+                        {'teeShirtSize': _teeShirtSize})
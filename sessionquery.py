@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""sessionquery.py
+
+Udacity conference server-side Python App Engine session search planner
+
+The datastore allows inequality filters on only one property per query
+(and != is run as several queries, which can't be paged).  plan() splits
+a set of session filters into the part pushed to the datastore and a
+residual evaluated in Python as results stream past:
+
+- every equality filter is pushed; equality-only queries, with or
+  without an ancestor, are answered by merge-joining the built-in
+  single-property indexes, so no composite index is needed for any
+  mix of them;
+- with no equality filter and no ancestor, the inequality filters on
+  the single most selective property are pushed instead (an ancestor
+  plus an inequality would need a composite index, so within one
+  conference inequalities are never pushed);
+- everything else (including every !=) becomes the residual.
+
+"""
+
+from datetime import datetime
+
+import endpoints
+
+from models import Session
+import queryfilters
+
+FIELDS = {'DATE': 'date',
+          'START_TIME': 'startTime',
+          'DURATION': 'duration',
+          'TYPE': 'typeOfSession',
+          'SPEAKER': 'speaker'}
+
+# most selective first: a speaker has a handful of sessions, while a
+# type or duration matches a large share of all sessions
+SELECTIVITY = ('speaker', 'startTime', 'date', 'duration', 'typeOfSession')
+
+REPEATED = ('typeOfSession',)
+
+
+def _parseValue(field, value):
+    """Convert a filter value string to the property's type."""
+    if field == 'date':
+        return datetime.strptime(value[:10], "%Y-%m-%d").date()
+    if field == 'startTime':
+        return datetime.strptime(value[:5], "%H:%M").time()
+    if field == 'duration':
+        return int(value)
+    return value
+
+
+def formatFilters(filters):
+    """Parse, check validity and format user supplied session filters."""
+    formatted_filters = []
+    for f in filters:
+        try:
+            field = FIELDS[f.field]
+            operator = queryfilters.OPERATORS[f.operator]
+        except KeyError:
+            raise endpoints.BadRequestException("Filter contains invalid"
+                                                " field or operator.")
+        try:
+            value = _parseValue(field, f.value or '')
+        except ValueError:
+            raise endpoints.BadRequestException(
+                "Invalid value for %s filter: %s" % (f.field, f.value))
+        formatted_filters.append({'field': field, 'operator': operator,
+                                  'value': value})
+    return formatted_filters
+
+
+def plan(filters, ancestor=False):
+    """Split formatted filters into (pushed, residual) lists for a
+    query with or without an ancestor."""
+    pushed = [f for f in filters if f['operator'] == '=']
+    if not pushed and not ancestor:
+        inequalities = set(f['field'] for f in filters
+                           if f['operator'] != '!=')
+        for field in SELECTIVITY:
+            if field in inequalities:
+                pushed = [f for f in filters if f['field'] == field and
+                          f['operator'] != '!=']
+                break
+    residual = [f for f in filters if f not in pushed]
+    return pushed, residual
+
+
+def buildQuery(pushed, ancestor=None):
+    """Return a Session query applying the pushed filters."""
+    q = Session.query(ancestor=ancestor)
+    for filtr in pushed:
+        # through the property, not a bare FilterNode: date and startTime
+        # are stored as datetimes, and only the property converts them
+        prop = Session._properties[filtr['field']]
+        q = q.filter(prop._comparison(filtr['operator'], filtr['value']))
+    return q
+
+
+def matches(session, residual):
+    """Return True if a session passes every residual filter; != on
+    typeOfSession means "is none of" ("not a Workshop")."""
+    return queryfilters.matches(session, residual, REPEATED, none_of=True)
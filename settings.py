@@ -17,3 +17,22 @@ WEB_CLIENT_ID = ("306340879409-orqar175blnldrtr5r88vh3coll4h3g7.apps."
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# How utils.getUserId(id_type="oauth") verifies bearer tokens: 'tokeninfo'
+# asks Google's tokeninfo endpoint; 'local' checks ID token signatures
+# against Google's cached signing certs first, falling back to tokeninfo
+# for access tokens.
+TOKEN_VERIFICATION = 'tokeninfo'
+
+# Most confirmation emails mailer.drain() sends per second.
+MAIL_SEND_RATE = 5
+
+# Log every request's RPC summary and return it in an X-RPC-Stats
+# response header (see rpcstats.py).
+RPC_STATS_DEBUG = False
+
+# Opt-in sampling profiler (see profiler.py): profile this fraction of
+# requests, and/or every request taking at least PROFILE_SLOW_MS.  Both
+# off by default.
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_SLOW_MS = None
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""soldout.py
+
+Udacity conference server-side Python App Engine "nearly sold out"
+announcement
+
+The set of nearly sold out conferences (websafe key -> name) is kept in
+memcache and updated with compare-and-set whenever a conference's seat
+count crosses NEARLY_SOLD_OUT_SEATS, so the announcement is rebuilt
+straight away from the set instead of by querying every conference.
+If the set is lost (evicted, or too contended to update) it is rebuilt
+from a datastore query, and the hourly cron rebuilds it the same way,
+correcting any drift from updates that failed or were lost.
+
+"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Conference
+
+MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+MEMCACHE_NEARLY_SOLD_OUT_KEY = "NEARLY_SOLD_OUT"
+ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
+                    'are nearly sold out: %s')
+NEARLY_SOLD_OUT_SEATS = 5
+CAS_RETRIES = 3
+
+
+def isNearlySoldOut(seats):
+    return 0 < (seats or 0) <= NEARLY_SOLD_OUT_SEATS
+
+
+def _setAnnouncement(nearly_sold_out):
+    """Set (or clear) the announcement for a nearly sold out set."""
+    if nearly_sold_out:
+        # If there are almost sold out conferences,
+        # format announcement and set it in memcache
+        announcement = ANNOUNCEMENT_TPL % (
+            ', '.join(sorted(nearly_sold_out.values())))
+        memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+    else:
+        # If there are no sold out conferences,
+        # delete the memcache announcements entry
+        announcement = ""
+        memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+    return announcement
+
+
+def rebuild():
+    """Rebuild the set and announcement from a datastore query."""
+    # whole entities: projecting name would need a composite
+    # (seatsAvailable, name) index, and few conferences match anyway
+    confs = Conference.query(ndb.AND(
+        Conference.seatsAvailable <= NEARLY_SOLD_OUT_SEATS,
+        Conference.seatsAvailable > 0)
+    ).fetch()
+    nearly_sold_out = dict((conf.key.urlsafe(), conf.name) for conf in confs)
+    memcache.set(MEMCACHE_NEARLY_SOLD_OUT_KEY, nearly_sold_out)
+    return _setAnnouncement(nearly_sold_out)
+
+
+def update(conf, seats):
+    """Record a conference's (possibly estimated) seat count, adding it
+       to or dropping it from the set if it crossed the threshold."""
+    wsck = conf.key.urlsafe()
+    nearly = isNearlySoldOut(seats)
+    client = memcache.Client()
+    for _ in range(CAS_RETRIES):
+        nearly_sold_out = client.gets(MEMCACHE_NEARLY_SOLD_OUT_KEY)
+        if nearly_sold_out is None:
+            # rebuild from the datastore, then apply this change on top
+            rebuild()
+            continue
+        # the common case: no threshold crossed, nothing to write
+        if nearly_sold_out.get(wsck) == (conf.name if nearly else None):
+            return
+        if nearly:
+            nearly_sold_out[wsck] = conf.name
+        else:
+            nearly_sold_out.pop(wsck, None)
+        if client.cas(MEMCACHE_NEARLY_SOLD_OUT_KEY, nearly_sold_out):
+            _setAnnouncement(nearly_sold_out)
+            return
+    # too contended; drop the set so the next update or cron rebuilds it
+    memcache.delete(MEMCACHE_NEARLY_SOLD_OUT_KEY)
@@ -293,6 +293,18 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.conferences = [];
 
+    /**
+     * Holds the token for the next page of the current query, if there is one.
+     * @type {string}
+     */
+    $scope.nextPageToken = null;
+
+    /**
+     * Holds the filters the first page of the current query was fetched with.
+     * @type {Array}
+     */
+    $scope.pageFilters = [];
+
     /**
      * Holds the state if offcanvas is enabled.
      *
@@ -423,10 +435,43 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
         }
     };
 
+    /**
+     * Fetches the next page of the current query and appends it to the conferences.
+     */
+    $scope.loadMoreConferences = function () {
+        if (!$scope.nextPageToken) {
+            return;
+        }
+        if ($scope.selectedTab == 'ALL') {
+            $scope.queryConferencesAll($scope.nextPageToken);
+        } else if ($scope.selectedTab == 'YOU_HAVE_CREATED') {
+            $scope.getConferencesCreated($scope.nextPageToken);
+        }
+    };
+
+    /**
+     * Adds a page of conferences to the ones displayed, or replaces them with the first page.
+     *
+     * @param resp the list response
+     * @param pageToken the token the page was fetched with, if any
+     */
+    $scope.showConferencesPage = function (resp, pageToken) {
+        if (!pageToken) {
+            $scope.conferences = [];
+            $scope.pagination.currentPage = 0;
+        }
+        angular.forEach(resp.items, function (conference) {
+            $scope.conferences.push(conference);
+        });
+        $scope.nextPageToken = resp.nextPageToken || null;
+    };
+
     /**
      * Invokes the conference.queryConferences API.
+     *
+     * @param pageToken the token of the page to fetch; the first page if omitted
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (pageToken) {
         var sendFilters = {
             filters: []
         }
@@ -440,6 +485,13 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                 });
             }
         }
+        if (pageToken) {
+            // a page token is only valid for the filters it was issued for
+            sendFilters.filters = $scope.pageFilters;
+            sendFilters.pageToken = pageToken;
+        } else {
+            $scope.pageFilters = sendFilters.filters;
+        }
         $scope.loading = true;
         gapi.client.conference.queryConferences(sendFilters).
             execute(function (resp) {
@@ -458,10 +510,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
-                        angular.forEach(resp.items, function (conference) {
-                            $scope.conferences.push(conference);
-                        });
+                        $scope.showConferencesPage(resp, pageToken);
                     }
                     $scope.submitted = true;
                 });
@@ -470,10 +519,16 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
 
     /**
      * Invokes the conference.getConferencesCreated method.
+     *
+     * @param pageToken the token of the page to fetch; the first page if omitted
      */
-    $scope.getConferencesCreated = function () {
+    $scope.getConferencesCreated = function (pageToken) {
+        var params = {};
+        if (pageToken) {
+            params.pageToken = pageToken;
+        }
         $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
+        gapi.client.conference.getConferencesCreated(params).
             execute(function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
@@ -495,10 +550,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
-                        angular.forEach(resp.items, function (conference) {
-                            $scope.conferences.push(conference);
-                        });
+                        $scope.showConferencesPage(resp, pageToken);
                     }
                     $scope.submitted = true;
                 });
@@ -527,7 +579,9 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         }
                     } else {
                         // The request has succeeded.
-                        $scope.conferences = resp.result.items;
+                        $scope.conferences = resp.result.items || [];
+                        $scope.nextPageToken = null;
+                        $scope.pagination.currentPage = 0;
                         $scope.loading = false;
                         $scope.messages = 'Query succeeded : Conferences you will attend (or you have attended)';
                         $scope.alertStatus = 'success';
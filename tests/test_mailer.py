@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""test_mailer.py
+
+The outbound mail pipeline (mailer.py) against the testbed mail and
+taskqueue stubs, with queue.yaml loaded for the mail-outbox pull queue.
+
+Run from the repository root with the App Engine SDK on PYTHONPATH:
+
+    python -m unittest discover tests
+
+"""
+
+import base64
+import json
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+from conference import ConferenceApi
+from models import ConferenceForm
+import mailer
+
+USER = 'attendee@example.com'
+
+
+class MailerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_mail_stub()
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_search_stub()
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        self.mail = self.testbed.get_stub(testbed.MAIL_SERVICE_NAME)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def enqueue(self, to, dedupe_key):
+        ndb.transaction(lambda: mailer.enqueueTransactionalAsync(
+            to, 'Subject', 'Body', dedupe_key).get_result())
+
+    def outbox(self):
+        return [json.loads(base64.b64decode(task['body']))
+                for task in self.taskqueue.GetTasks(mailer.MAIL_QUEUE)]
+
+    def testDrainSendsQueuedMail(self):
+        self.enqueue(USER, 'first')
+        self.enqueue(USER, 'second')
+        self.assertEqual(mailer.drain(), 2)
+        self.assertEqual(len(self.mail.get_sent_messages(to=USER)), 2)
+        self.assertEqual(self.outbox(), [])
+
+    def testSentMessageIsNotResent(self):
+        self.enqueue(USER, 'once')
+        mailer.drain()
+        # the same message queued again, e.g. a redelivered task
+        self.enqueue(USER, 'once')
+        mailer.drain()
+        self.assertEqual(len(self.mail.get_sent_messages(to=USER)), 1)
+        self.assertEqual(self.outbox(), [])
+
+    def testFailedSendIsRequeuedWithItsAttempts(self):
+        # mail.send_mail refuses a message without a recipient
+        self.enqueue('', 'broken')
+        self.assertEqual(mailer.drain(), 0)
+        requeued = self.outbox()
+        self.assertEqual(len(requeued), 1)
+        self.assertEqual(requeued[0]['attempts'], 1)
+        self.assertEqual(self.mail.get_sent_messages(), [])
+
+    def testCreateConferenceQueuesConfirmation(self):
+        self.testbed.setup_env(ENDPOINTS_AUTH_EMAIL=USER,
+                               ENDPOINTS_AUTH_DOMAIN='example.com',
+                               overwrite=True)
+        ConferenceApi().createConference(ConferenceForm(
+            name='Conference', city='London', maxAttendees=10))
+        outbox = self.outbox()
+        self.assertEqual(len(outbox), 1)
+        self.assertEqual(outbox[0]['to'], USER)
+        mailer.drain()
+        self.assertEqual(len(self.mail.get_sent_messages(to=USER)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+
+"""test_rpc_counts.py
+
+Datastore RPCs issued by the conference list endpoints, counted on the
+App Engine testbed stubs with an apiproxy pre-call hook.
+
+Run from the repository root with the App Engine SDK on PYTHONPATH:
+
+    python -m unittest discover tests
+
+"""
+
+import collections
+import os
+import sys
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+from protorpc import message_types
+
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceQueryForms
+from models import Profile
+
+USER = 'attendee@example.com'
+ORGANISER = 'organiser@example.com'
+CONFERENCES = 3
+
+_calls = collections.Counter()
+
+
+def _countCall(service, call, request, response):
+    """apiproxy pre-call hook: count RPCs as 'service.Call'."""
+    _calls['%s.%s' % (service, call)] += 1
+
+
+class RpcCountTest(unittest.TestCase):
+    """RpcCountTest -- three conferences sharing one organiser, all
+    attended by the current user"""
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.setup_env(ENDPOINTS_AUTH_EMAIL=USER,
+                               ENDPOINTS_AUTH_DOMAIN='example.com',
+                               overwrite=True)
+        # count datastore RPCs only: don't let ndb's memcache answer gets
+        ndb.get_context().set_memcache_policy(False)
+
+        p_key = ndb.Key(Profile, ORGANISER)
+        confs = [Conference(parent=p_key, name='Conference %d' % i,
+                            organizerUserId=ORGANISER, city='London',
+                            maxAttendees=10, seatsAvailable=10)
+                 for i in range(CONFERENCES)]
+        c_keys = ndb.put_multi(confs)
+        ndb.put_multi([
+            Profile(key=p_key, displayName='Organiser', mainEmail=ORGANISER),
+            Profile(id=USER, displayName='Attendee', mainEmail=USER,
+                    conferenceKeysToAttend=[c_key.urlsafe()
+                                            for c_key in c_keys])])
+
+        # start each request with a cold in-context cache
+        ndb.get_context().clear_cache()
+        self.api = ConferenceApi()
+        _calls.clear()
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'test_rpc_counts', _countCall)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def datastoreCalls(self):
+        return dict((call, count)
+                    for call, count in _calls.items()
+                    if call.startswith('datastore_v3.'))
+
+    def testQueryConferences(self):
+        forms = self.api.queryConferences(ConferenceQueryForms())
+        self.assertEqual(len(forms.items), CONFERENCES)
+        self.assertEqual(set(form.organizerDisplayName
+                             for form in forms.items), set(['Organiser']))
+        # one query for the page, one batch get of the organisers
+        self.assertEqual(self.datastoreCalls(),
+                         {'datastore_v3.RunQuery': 1,
+                          'datastore_v3.Get': 1})
+
+    def testGetConferencesToAttend(self):
+        forms = self.api.getConferencesToAttend(
+            message_types.VoidMessage())
+        self.assertEqual(len(forms.items), CONFERENCES)
+        self.assertEqual(set(form.organizerDisplayName
+                             for form in forms.items), set(['Organiser']))
+        # the user's Profile, then one batch get of the conferences and
+        # their organisers together; no query
+        self.assertEqual(self.datastoreCalls(),
+                         {'datastore_v3.Get': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
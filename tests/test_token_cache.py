@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""test_token_cache.py
+
+utils.getUserId(id_type="oauth") against a local tokeninfo stub: the
+first sight of a token asks tokeninfo, later ones are answered from the
+caches, and a rejected token is neither accepted nor cached.
+
+Run from the repository root with the App Engine SDK on PYTHONPATH:
+
+    python -m unittest discover tests
+
+"""
+
+import json
+import os
+import sys
+import unittest
+import urlparse
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+from google.appengine.api import apiproxy_stub
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import testbed
+
+from cache import LRUCache
+import utils
+
+USER_ID = '1234567890'
+
+
+class TokenInfoStub(apiproxy_stub.APIProxyStub):
+    """TokenInfoStub -- urlfetch stub standing in for the tokeninfo
+    service, which knows one token"""
+
+    def __init__(self, token):
+        super(TokenInfoStub, self).__init__('urlfetch')
+        self.token = token
+        self.fetches = 0
+
+    def _Dynamic_Fetch(self, request, response):
+        self.fetches += 1
+        query = urlparse.parse_qs(urlparse.urlparse(request.url()).query)
+        token = (query.get('id_token') or query.get('access_token'))[0]
+        if token == self.token:
+            response.set_statuscode(200)
+            response.set_content(json.dumps({'user_id': USER_ID,
+                                             'expires_in': 3600}))
+        else:
+            response.set_statuscode(400)
+            response.set_content(json.dumps({'error': 'invalid_token'}))
+
+
+class TokenCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_memcache_stub()
+        self.tokeninfo = TokenInfoStub('good-token')
+        apiproxy_stub_map.apiproxy.RegisterStub('urlfetch', self.tokeninfo)
+        utils._token_cache = LRUCache(utils.TOKEN_CACHE_SIZE)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def userId(self, token):
+        self.testbed.setup_env(HTTP_AUTHORIZATION='Bearer %s' % token,
+                               overwrite=True)
+        return utils.getUserId(None, id_type='oauth')
+
+    def testCacheMissAsksTokenInfo(self):
+        self.assertEqual(self.userId('good-token'), USER_ID)
+        self.assertEqual(self.tokeninfo.fetches, 1)
+
+    def testCacheHit(self):
+        self.userId('good-token')
+        self.assertEqual(self.userId('good-token'), USER_ID)
+        # another instance: only memcache has it
+        utils._token_cache = LRUCache(utils.TOKEN_CACHE_SIZE)
+        self.assertEqual(self.userId('good-token'), USER_ID)
+        self.assertEqual(self.tokeninfo.fetches, 1)
+
+    def testRejectedTokenIsNotCached(self):
+        self.assertEqual(self.userId('bad-token'), '')
+        fetches = self.tokeninfo.fetches
+        self.assertEqual(self.userId('bad-token'), '')
+        self.assertEqual(self.tokeninfo.fetches, 2 * fetches)
+
+    def testClaimsChecked(self):
+        good = {'iss': 'accounts.google.com', 'aud': utils.WEB_CLIENT_ID,
+                'azp': utils.WEB_CLIENT_ID}
+        self.assertTrue(utils._trustedClaims(good))
+        for claim, value in (('iss', 'evil.example.com'),
+                             ('aud', 'another-app'),
+                             ('azp', 'another-client')):
+            claims = dict(good)
+            claims[claim] = value
+            self.assertFalse(utils._trustedClaims(claims), claim)
+
+
+if __name__ == '__main__':
+    unittest.main()
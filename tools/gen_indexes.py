@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+"""gen_indexes.py
+
+Regenerate the indexes in index.yaml: every filter set queryConferences
+accepts (any subset of FIELDS, each with any of OPERATORS, at most one
+property with inequalities) is planned with confquery.plan, in both
+list views, and the union of the composite indexes the plans need is
+written above index.yaml's AUTOGENERATED marker, followed by
+conference.SUMMARY_INDEXES, the indexes the other view=SUMMARY
+projections need.  Every other index in the file, added by hand or by
+the dev_appserver, is kept where it is, except for Conference indexes
+without an ancestor above the marker: those are this tool's own
+queryConferences indexes, recomputed on every run, so a hand-maintained
+one of that shape belongs below the marker.
+
+Run from the repository root with the App Engine SDK on PYTHONPATH:
+
+    python tools/gen_indexes.py [--check]
+
+--check only reports whether index.yaml is up to date.
+
+"""
+
+import itertools
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, ROOT)
+
+import yaml
+
+from conference import CONFERENCE_SUMMARY_FIELDS
+from conference import FIELDS
+from conference import SUMMARY_INDEXES
+from queryfilters import OPERATORS
+import confquery
+
+INDEX_YAML = os.path.join(ROOT, 'index.yaml')
+
+HEADER = """\
+indexes:
+
+# These indexes are generated by tools/gen_indexes.py: the Conference
+# indexes queryConferences needs, from conference.FIELDS and
+# queryfilters.OPERATORS, then conference.SUMMARY_INDEXES.  Rerun it
+# rather than editing them by hand.  It keeps every other index, except
+# a Conference index without an ancestor above the AUTOGENERATED marker.
+
+"""
+
+MARKER = '# AUTOGENERATED'
+
+AUTOGENERATED = MARKER + """
+
+# This index.yaml is automatically updated whenever the dev_appserver
+# detects that a new type of query is run.  If you want to manage the
+# index.yaml file manually, remove the above marker line (the line
+# saying "# AUTOGENERATED").  If you want to manage some indexes
+# manually, move them above the marker line.  The index.yaml file is
+# automatically uploaded to the admin console when you next deploy
+# your application using appcfg.py.
+
+"""
+
+
+def filterSets():
+    """Yield (inequality field, formatted filters) for every filter
+    shape queryConferences accepts."""
+    fields = sorted(FIELDS.values())
+    inequalities = sorted(set(OPERATORS.values()) - set(['=']))
+    for n in range(len(fields) + 1):
+        for combo in itertools.combinations(fields, n):
+            yield None, [{'field': f, 'operator': '=', 'value': None}
+                         for f in combo]
+            for field in combo:
+                equalities = [{'field': f, 'operator': '=', 'value': None}
+                              for f in combo if f != field]
+                for k in range(1, len(inequalities) + 1):
+                    for ops in itertools.combinations(inequalities, k):
+                        yield field, equalities + [
+                            {'field': field, 'operator': op, 'value': None}
+                            for op in ops]
+
+
+def requiredIndexes():
+    """Return the sorted set of Conference composite indexes."""
+    indexes = set()
+    for inequality_field, filters in filterSets():
+        query_plan = confquery.plan(inequality_field, filters)
+        for projection in (None, list(CONFERENCE_SUMMARY_FIELDS)):
+            indexes.update(confquery.requiredIndexes(query_plan,
+                                                     projection))
+    return sorted(indexes)
+
+
+def _index(kind, ancestor, properties):
+    """Return an index in index.yaml's form."""
+    index = {'kind': kind,
+             'properties': [{'name': name} for name in properties]}
+    if ancestor:
+        index['ancestor'] = 'yes'
+    return index
+
+
+def generatedIndexes():
+    """Return the indexes this tool writes, in index.yaml's form."""
+    return ([_index('Conference', False, properties)
+             for properties in requiredIndexes()] +
+            [_index(*index) for index in SUMMARY_INDEXES])
+
+
+def _entry(index):
+    ancestor = ''
+    if index.get('ancestor') in ('yes', True):
+        ancestor = '  ancestor: yes\n'
+    return '- kind: %s\n%s  properties:\n%s\n' % (
+        index['kind'], ancestor, ''.join(
+            '  - name: %s\n' % prop['name'] +
+            ('    direction: %s\n' % prop['direction']
+             if 'direction' in prop else '')
+            for prop in index['properties']))
+
+
+def render(above, below):
+    """Return index.yaml text: generated indexes and the kept ones above
+    the marker, then the marker and the kept ones below it."""
+    return (HEADER + ''.join(_entry(index)
+                             for index in generatedIndexes() + above) +
+            AUTOGENERATED + ''.join(_entry(index) for index in below))
+
+
+def keptIndexes(text):
+    """Return (above, below): the indexes to keep from index.yaml text,
+    on each side of the marker."""
+    lines = text.splitlines(True)
+    split = len(lines)
+    for i, line in enumerate(lines):
+        if line.strip() == MARKER:
+            split = i
+            break
+    generated = [_entry(index) for index in generatedIndexes()]
+
+    def parse(part):
+        return [index for index in (yaml.safe_load(part) or {}).get(
+                'indexes') or [] if _entry(index) not in generated]
+    above = [index for index in parse(''.join(lines[:split]))
+             if index['kind'] != 'Conference' or index.get('ancestor')]
+    below = parse('indexes:\n' + ''.join(lines[split + 1:]))
+    return above, below
+
+
+def main(argv):
+    with open(INDEX_YAML) as f:
+        current = f.read()
+    text = render(*keptIndexes(current))
+    if '--check' in argv:
+        if text != current:
+            print('index.yaml is out of date; run tools/gen_indexes.py')
+            return 1
+        print('index.yaml is up to date')
+        return 0
+    with open(INDEX_YAML, 'w') as f:
+        f.write(text)
+    print('wrote %d indexes' % len(generatedIndexes()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,11 +1,116 @@
+import hashlib
 import json
+import logging
 import os
 import time
 import uuid
 
+import endpoints
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
+from cache import LRUCache
 from models import Profile
 
+from settings import ANDROID_AUDIENCE
+from settings import ANDROID_CLIENT_ID
+from settings import IOS_CLIENT_ID
+from settings import TOKEN_VERIFICATION
+from settings import WEB_CLIENT_ID
+
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+TOKENINFO_ATTEMPTS = 3
+TOKEN_CACHE_SIZE = 1000
+TOKEN_CACHE_MAX_TTL = 3600      # seconds; never beyond the token's expiry
+MEMCACHE_TOKEN_KEY = "TOKEN_%s"
+# what the endpoints library itself accepts for the conference API
+ID_TOKEN_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+ID_TOKEN_AUDIENCES = (ANDROID_AUDIENCE,)
+ID_TOKEN_CLIENT_IDS = (WEB_CLIENT_ID, endpoints.API_EXPLORER_CLIENT_ID,
+                       ANDROID_CLIENT_ID, IOS_CLIENT_ID)
+
+# in-process LRU of token hash -> user_id
+_token_cache = LRUCache(TOKEN_CACHE_SIZE)
+
+
+def _cachedUserId(token_hash):
+    """Return a cached user id for a token, or None if not cached."""
+    user_id = _token_cache.get(token_hash)
+    if user_id is not None:
+        return user_id
+
+    entry = memcache.get(MEMCACHE_TOKEN_KEY % token_hash)
+    if entry and entry[1] > time.time():
+        _rememberUserId(token_hash, entry[0], entry[1], local_only=True)
+        return entry[0]
+    return None
+
+
+def _rememberUserId(token_hash, user_id, expires_at, local_only=False):
+    """Cache a verified user id until the token expires."""
+    _token_cache.set(token_hash, user_id, expires_at - time.time())
+    if not local_only:
+        memcache.set(MEMCACHE_TOKEN_KEY % token_hash, (user_id, expires_at),
+                     time=max(int(expires_at - time.time()), 1))
+
+
+def _fetchTokenInfo(token):
+    """Ask the tokeninfo service who a token belongs to;
+       return (user_id, expires_in) or None."""
+    token_type = 'id_token'
+    if 'OAUTH_USER_ID' in os.environ:
+        token_type = 'access_token'
+    url = TOKENINFO_URL % (token_type, token)
+    # retry straight away instead of sleeping in the request thread;
+    # the client can retry the whole call if tokeninfo is down
+    for i in range(TOKENINFO_ATTEMPTS):
+        resp = urlfetch.fetch(url)
+        if resp.status_code == 200:
+            info = json.loads(resp.content)
+            return info.get('user_id', ''), int(info.get('expires_in', 0))
+        elif resp.status_code == 400 and 'invalid_token' in resp.content:
+            url = TOKENINFO_URL % ('access_token', token)
+    return None
+
+
+def _signedJwtPayload(token, now):
+    """Return an ID token's payload if its signature checks out against
+       Google's (memcached) signing certs, else None.  This is the only
+       use of the endpoints library's private JWT helpers; if they are
+       gone, return None so the caller falls back to tokeninfo."""
+    try:
+        from endpoints import users_id_token
+        verify = users_id_token._verify_signed_jwt_with_certs
+        invalid = users_id_token._AppIdentityError
+    except (ImportError, AttributeError):
+        logging.warning('local ID token verification unavailable',
+                        exc_info=True)
+        return None
+    try:
+        return verify(token, now, memcache)
+    except invalid:
+        return None
+
+
+def _trustedClaims(payload):
+    """Check an ID token's issuer, audience and authorized party the way
+       the endpoints library does."""
+    aud = payload.get('aud')
+    azp = payload.get('azp')
+    return (payload.get('iss') in ID_TOKEN_ISSUERS and bool(aud) and
+            (aud == azp or aud in ID_TOKEN_AUDIENCES) and
+            azp in ID_TOKEN_CLIENT_IDS)
+
+
+def _verifyIdToken(token):
+    """Verify an ID token locally against Google's (cached) signing
+       certs; return (user_id, expires_in) or None."""
+    now = int(time.time())
+    payload = _signedJwtPayload(token, now)
+    if payload is None or not _trustedClaims(payload):
+        return None
+    return payload.get('sub', ''), int(payload.get('exp', now)) - now
+
+
 def getUserId(user, id_type="email"):
     if id_type == "email":
         return user.email()
@@ -14,25 +119,24 @@ def getUserId(user, id_type="email"):
         """A workaround implementation for getting userid."""
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        token_hash = hashlib.sha256(token).hexdigest()
+        user_id = _cachedUserId(token_hash)
+        if user_id is not None:
+            return user_id
+
+        info = None
+        if TOKEN_VERIFICATION == 'local':
+            info = _verifyIdToken(token)
+        if info is None:
+            info = _fetchTokenInfo(token)
+        if not info or not info[0]:
+            return ''
+
+        user_id, expires_in = info
+        ttl = min(expires_in, TOKEN_CACHE_MAX_TTL)
+        if ttl > 0:
+            _rememberUserId(token_hash, user_id, time.time() + ttl)
+        return user_id
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm